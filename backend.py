@@ -3,15 +3,32 @@
 of frontend. Frontend communication must be implemented in a separate file.
 """
 
-from descriptors import StrokeDescriptors
-from intersection import SelfIntersection, LineIntersection
-from simplify import simplify_dp
+from descriptors import StrokeDescriptors, StrokeAnalysis, pack_strokes
+from intersection import SelfIntersection, MultiLineIntersection, \
+     PackedLines
+from spatial import GridIndex, bbox
+from scene import SceneStore, Registry
+import tracing
+import raytrace
 
-import math
 import numpy as np
-from numpy.linalg import svd
+from pca import pca
 import logging
 
+def _store_column(name, doc=None):
+    """Property reading and writing the row of a handle in a SceneStore
+    column (copies are returned for vectors)."""
+    def get(self):
+        value = getattr(self._store, name)[self.row]
+        if isinstance(value, np.ndarray): value = value.copy()
+        return value
+
+    def set(self, value):
+        getattr(self._store, name)[self.row] = value
+
+    return property(get, set, doc=doc)
+
+
 class Baseline(object):
     def __init__(self, frontend, ylocation, span=300):
         self.ylocation = ylocation
@@ -20,19 +37,31 @@ class Baseline(object):
 
 
 class Lens(object):
-    def __init__(self, frontend, xlocation, baseline, focal=50.,
+    """Lens handle: parameters are stored in a row of a SceneStore."""
+    def __init__(self, frontend, store, xlocation, baseline, focal=50.,
                  span=70, kind="thin"):
         # kind can be "undefined" or "thin"
-        self.xlocation = xlocation
-        self.focal = focal
+        self._store = store
         self.baseline = baseline
-        self.span = span
+        store.add_lens(self, xlocation, focal, span, baseline.ylocation)
         self.polyline = np.asarray([[xlocation, baseline.ylocation-span],
                                     [xlocation, baseline.ylocation+span]])
         self._frontend_object = frontend.add_lens(xlocation, baseline,
                                                   focal=focal,
                                                   span=span, kind=kind)
 
+    def _get_xlocation(self):
+        return self._store.lens_x[self.row]
+
+    def _set_xlocation(self, xlocation):
+        self._store.set_lens_x(self, xlocation)
+
+    xlocation = property(_get_xlocation, _set_xlocation,
+                         doc="Location along the baseline. Setting it can "
+                         "change the lens row.")
+    focal = _store_column('lens_focal')
+    span = _store_column('lens_span')
+
     def update(self, with_span = False):
         self.polyline = np.asarray([[self.xlocation, self.baseline.ylocation-self.span],
                                     [self.xlocation, self.baseline.ylocation+self.span]])
@@ -45,20 +74,41 @@ class Lens(object):
         
 
 class Ray(object):
+    """Ray handle: parameters are stored in a row of the SceneStore of the
+    engine."""
     def __init__(self, frontend, backend, basepoint, unit):
         """basepoint: point through which the ray passes.
         unit: unitary vector along the ray, at basepoint."""
-        self.basepoint = basepoint
-        self.unit = unit
+        self._store = backend._store
+        self._store.add_ray(self, basepoint, unit)
         self.backend = backend
         
-        self.polyline = self.backend.ray_polyline(self.basepoint, self.unit)
-        self._frontend_object = frontend.add_ray(self.polyline, basepoint, unit)
+        self._trace()
+        self._frontend_object = frontend.add_ray(self.polyline, self.basepoint,
+                                                 self.unit)
+
+    basepoint = _store_column('ray_basepoint')
+    unit = _store_column('ray_unit')
+
+    @property
+    def polyline(self):
+        """Traced polyline (copy of the scene store row)."""
+        return self._store.ray_polyline[self.row].copy()
 
 
-    def update(self):
-        """Update ray."""
-        self.polyline = self.backend.ray_polyline(self.basepoint, self.unit)        
+    def _trace(self):
+        """Trace the ray alone, and store its polyline."""
+        self._store.set_polyline(self, self.backend.ray_polyline(self.basepoint,
+                                                                 self.unit))
+
+
+    def update(self, traced=False):
+        """Update ray.
+        traced: the polyline has already been traced with other rays, in
+        the scene store (see RecognitionEngine.update_rays()). Traced alone
+        otherwise."""
+        if not traced:
+            self._trace()
         self._frontend_object.update(self.polyline, self.basepoint, self.unit)
 
 
@@ -69,8 +119,17 @@ class RecognitionEngine(object):
         """Initialize various caches."""
 
         self._baseline = None
-        self._lenses = []
-        self._rays = []
+        # Lenses (sorted by location) and rays
+        self._store = SceneStore()
+        # Every scene object, by id and by frontend object
+        self._registry = Registry()
+        # Bounding boxes of scene objects, and their polylines packed for
+        # intersection searches (see scratch_get_todelete())
+        self._scene_index = GridIndex()
+        self._targets = None
+        self._stale_targets = 0
+        # Ray tracer for the current lenses (see ray_tracer())
+        self._tracer = None
 
 
     def set_frontend(self, frontend):
@@ -83,8 +142,8 @@ class RecognitionEngine(object):
         if self._baseline:
             s+="Baseline: ylocation = "+str(self._baseline.ylocation)+"\n"
 
-        if self._lenses:
-            for l in self._lenses:
+        if self._store.lenses:
+            for l in self._store.lenses:
                 s+="Lens: xlocation = "+str(l.xlocation)+"\n"
 
         return s
@@ -104,38 +163,52 @@ class RecognitionEngine(object):
                 self.frontend.remove_object(obj._frontend_object)
 
             if isinstance(obj, Ray):
-                del self._rays[self._rays.index(obj)]
+                self._store.remove_ray(obj)
+                self._forget_object(obj)
             elif isinstance(obj, Lens):
-                del self._lenses[self._lenses.index(obj)]
+                self._store.remove_lens(obj)
+                self._forget_object(obj)
+                self._tracer = None
                 deleted_lenses = deleted_lenses + 1
             elif isinstance(obj, Baseline) and len(objects_list) == 1:
                 # Baseline can be deleted only if nothing else must be deleted.
                 self._baseline = None
                 deleted_baseline = True
                 self.frontend.remove_object(obj._frontend_object)
+                self._forget_object(obj)
 ##                 del self._baseline[self._baseline.index(obj)]
 
         # Erase everything if the baseline has been deleted
         if (deleted_baseline):
-            for obj in self._rays + self._lenses:
+            for obj in self._store.rays + self._store.lenses:
                 self.frontend.remove_object(obj._frontend_object)
-            self._rays = []
-            self._lenses = []            
+            self._store.clear()
+            self._registry.clear()
+            self._scene_index.clear()
+            self._targets = None
+            self._tracer = None
             return
         
         # Update rays if a lens has been deleted
         if (deleted_lenses > 0):
-            for ray in self._rays: ray.update()
+            self.update_rays()
 
                 
-    def push_stroke(self, stroke):
-        """Provides the engine with a new stroke. Interpretation is performed."""
+    def push_stroke(self, stroke, descriptors=None, algorithm="dp"):
+        """Provides the engine with a new stroke. Interpretation is performed.
+        descriptors: StrokeDescriptors object for the stroke, if already
+        computed while the stroke was drawn.
+        algorithm: simplification algorithm, "dp" or "vw" (see
+        simplify.simplify())"""
         
         logging.debug("--- Raw line ---")
         logging.debug("number of points: "+str(len(stroke)))
         # print "coordinates: ", stroke
 
-        descriptors = StrokeDescriptors(stroke)
+        analysis = StrokeAnalysis(stroke, descriptors=descriptors,
+                                  algorithm=algorithm)
+        threshold = analysis.threshold
+        descriptors = analysis.descriptors
         logging.info("--- Descriptors ---")
         logging.debug(str(descriptors))
 
@@ -143,21 +216,18 @@ class RecognitionEngine(object):
         logging.info("--- Detectors ---")
 
         point = descriptors.point_detector()
-        line  = descriptors.straight_line_detector()
-        baseline = self.baseline_detector(descriptors)
-        lens = self.lens_detector(descriptors)
-        ray = self.ray_detector(descriptors)
-
-        threshold = 1.
-        d = simplify_dp(stroke[:,0], stroke[:,1])
-        s = stroke[d>threshold]
+        line  = analysis.straight_line
+        baseline = self.baseline_detector(analysis)
+        lens = self.lens_detector(analysis)
+        ray = self.ray_detector(analysis)
+
+        s = analysis.simplified
         logging.debug("simplification threshold: "+str(threshold))
         logging.debug("number of points after simplification: "+ str(len(s)))
         ## logging.debug("adding simplified line")
         ## self.frontend.add_line(s, kind="generic")
 
-        simplified_descriptors = StrokeDescriptors(s)
-        scratch = self.scratch_detector(simplified_descriptors)
+        scratch = self.scratch_detector(analysis.simplified_descriptors)
 
         logging.info("Point detector   : "+str(point))
         logging.info("Line detector    : "+str(line))
@@ -166,10 +236,9 @@ class RecognitionEngine(object):
         logging.info("Ray detector     : "+str(ray))
         logging.info("Scratch detector : "+str(scratch))
 
-        logging.info("--- Corners detection ---")
-        resamp = descriptors.resample()
-        corners1 = descriptors.corners1(w=10)
-        print corners1
+        if tracing.detectors:
+            corners, corner_lengths, resampled = analysis.corners
+            tracing.event('detectors', 'corners', points=resampled[corners])
         # Make recognition decision and call frontend here.
         if scratch[0]:
             logging.info("Processing scratch")
@@ -187,6 +256,7 @@ class RecognitionEngine(object):
                 logging.info("Adding baseline")
                 ylocation = (stroke[0,1] + stroke[-1, 1])/2.
                 self._baseline = Baseline(self.frontend, ylocation)
+                self._add_object(self._baseline)
                 return
             else:
                 logging.error("Already a baseline")
@@ -196,17 +266,18 @@ class RecognitionEngine(object):
             logging.info("Adding a lens")
             xlocation = (stroke[0,0] + stroke[-1, 0])/2.
             span = abs(stroke[0,1] - stroke[-1,1])/2.
-            self._lenses.append(Lens(self.frontend, xlocation, 
-                                     self._baseline._frontend_object,
-                                     focal=default_focal_length,
-                                     span=span))
+            lens = Lens(self.frontend, self._store, xlocation,
+                        self._baseline._frontend_object,
+                        focal=default_focal_length, span=span)
+            self._add_object(lens)
+            self._tracer = None
             # Update ray objects.
-            for ray in self._rays: ray.update()
+            self.update_rays()
             return
 
         if ray[0]:
             logging.info("Adding a ray")
-            self._rays.append(Ray(self.frontend, self, *ray[1:]))
+            self._add_object(Ray(self.frontend, self, *ray[1:]))
             return
             
         ## if line[0]:
@@ -220,8 +291,10 @@ class RecognitionEngine(object):
 
 ## Display loops (debug)
 ##         intersections = SelfIntersection(descriptors)        
-##         for loop in intersections.get_loops():
-##             self.frontend.add_line(descriptors.extract(*loop), kind="loop")
+##         points, offsets = descriptors.extract_many(intersections.get_loops())
+##         for k in range(len(offsets)-1):
+##             self.frontend.add_line(points[offsets[k]:offsets[k+1]],
+##                                    kind="loop")
 
 
 ## Detectors
@@ -232,23 +305,25 @@ class RecognitionEngine(object):
         return (vector * factor)
 
         
-    def ray_detector(self, descriptors):
+    def ray_detector(self, analysis):
         """Detect if a stroke can be a ray.
+        analysis: StrokeAnalysis object for the stroke.
         Criteria :
         - straight line
         - end or start point near a lens
         (if there is no lens, there can be no rays)
         """
-        if len(self._lenses) == 0:
+        if self._store.nlenses == 0:
             return (False,)
 
+        descriptors = analysis.descriptors
         result = False
-        line = descriptors.straight_line_detector()
+        line = analysis.straight_line
         if line[0]:
             closest_lens = None
             min_distance = 2000000
             ending = None # "start" or "end"
-            for lens in self._lenses:
+            for lens in self._store.lenses:
                 if abs(descriptors._a[0,0] - lens.xlocation) < min_distance:
                     closest_lens = lens
                     min_distance = abs(descriptors._a[0,0] - lens.xlocation)
@@ -299,76 +374,46 @@ class RecognitionEngine(object):
             return(False,)
         
     
-    def ray_polyline(self, basepoint, unit):
-        # Get sorted lens locations
-        lenses_x = np.array([(l.xlocation, l.focal,
-                              l._frontend_object.ylocation)
-                             for l in self._lenses])
-        I = lenses_x[:,0].argsort()
-        lenses_x = lenses_x[I, :]
-        
-        index = lenses_x[:,0].searchsorted(basepoint[0])
+    def lens_table(self):
+        """Return lenses as a table sorted by location (see raytrace)."""
+        return self._store.lens_table()
 
-        # Propagate on the right
-        rpoints=[]
-        point = basepoint
-        if unit[0] > 0: vector = unit
-        else: vector = -unit
-            
-        for l in lenses_x[index:,:]:
-            point, vector = self.lens_transmission(point, vector,
-                                                   l[0], l[2], l[1],
-                                                   direction="right")
-            rpoints.append((point,vector))
-        rpoints.append((point + 200*vector, vector))
-        
-        # Propagate on the left
-        lpoints=[]
-        point = basepoint
-        if unit[0] > 0: vector = unit
-        else: vector = -unit
-
-        if index == 0:
-            llenses = []
-        else:
-            llenses = lenses_x[index-1::-1,:]
-            
-        for l in llenses:
-            point, vector = self.lens_transmission(point, vector,
-                                                   l[0], l[2], l[1],
-                                                   direction="left")
-            lpoints.append((point,vector))
-        lpoints.append((point - 200*vector, vector))
-        lpoints.reverse()
-        
-        polyline = [p[0] for p in lpoints+rpoints]        
-        return np.asarray(polyline)
 
+    def ray_tracer(self):
+        """Return the RayTracer of the current lenses. It is kept until a
+        lens is added, deleted, or moved across another one: other lens
+        changes are applied to it by update_rays()."""
+        if self._tracer is None:
+            self._tracer = raytrace.RayTracer(self.lens_table())
+        return self._tracer
 
-    def lens_transmission(self, point, vector, xlocation, ylocation, focal, 
-                          direction="right"):
-        """Compute ray transmission through a lens.
-        direction can be "left" or "right" : light propagation direction.
-        xlocation, ylocation: coordinates of center of lens.
-        """
 
-        # Ray-lens intersection point
-        # h is the oriented distance between the base line and the point
-        # where the ray hits the lens.
-        h = point[1] + (xlocation-point[0])*vector[1]/vector[0]
-        point = np.asarray((xlocation,h))
-
-        # Ray vector after the lens.
-        if direction == "right":
-            vector = self.scale_to(
-                np.asarray((1., - (h - ylocation)/ focal
-                            + vector[1]/vector[0])))
+    def ray_polyline(self, basepoint, unit):
+        """Compute the polyline of one ray (see raytrace.trace())."""
+        polyline = self.ray_tracer().trace(basepoint, unit)[0]
+        if tracing.raytrace:
+            tracing.event('raytrace', 'ray', basepoint=basepoint, unit=unit,
+                          lenses=self._store.nlenses, polyline=polyline)
+        return polyline
+
+
+    def trace_rays(self, rays=None):
+        """Compute polylines of many rays at once (see raytrace.trace()).
+        rays: list of rays (every ray of the scene if None)
+        Returns an array of shape (len(rays), number of lenses + 2, 2)."""
+        if rays is None:
+            rays = self._store.rays
+            basepoints = self._store.basepoints()
+            units = self._store.units()
         else:
-            vector = self.scale_to(
-                np.asarray((1., + (h - ylocation) / focal
-                            + vector[1]/vector[0])))
-
-        return (point, vector)
+            basepoints = np.asarray([ray.basepoint
+                                     for ray in rays]).reshape(-1, 2)
+            units = np.asarray([ray.unit for ray in rays]).reshape(-1, 2)
+        polylines = self.ray_tracer().trace(basepoints, units)
+        if tracing.raytrace:
+            tracing.event('raytrace', 'rays', rays=len(rays),
+                          lenses=self._store.nlenses)
+        return polylines
 
 
     def inflection_points(self, descriptors, return_indices=False):
@@ -392,10 +437,12 @@ class RecognitionEngine(object):
             return(inflection_lengths)
     
 
-    def scratch_detector(self, descriptors):
+    def scratch_detector(self, descriptors, algorithm=None):
         """Detect if a stroke can be a scratch.
         Descriptors must be computed on a simplified line. Otherwise, angle
-        computations are too noisy.
+        computations are too noisy. If algorithm is given ("dp" or "vw"),
+        descriptors of the raw line are expected, and the line is
+        simplified here.
         
         Criteria:
         - maximum span greater than a threshold.
@@ -406,8 +453,13 @@ class RecognitionEngine(object):
         """
 
         logging.debug("-- scratch detector --")
+        if algorithm is not None:
+            descriptors = StrokeAnalysis(descriptors._a, algorithm=algorithm,
+                                         descriptors=descriptors
+                                         ).simplified_descriptors
         # If simplified line is perfectly straight, do nothing.
-        print descriptors._a.shape
+        if tracing.detectors:
+            tracing.event('detectors', 'scratch', points=len(descriptors._a))
         if descriptors._a.shape[0] <= 2: return (False,)
         
         size = max(descriptors._span)
@@ -419,15 +471,8 @@ class RecognitionEngine(object):
         if len(inflection_points) < 2: return (False, inflection_points)
 
         # Compute pca on inflection points
-        m = np.dot(np.ones(inflection_points.shape),
-                   np.diagflat(inflection_points.mean(0)))
-        U,S,V = svd(inflection_points - m, full_matrices=False);
-
-        # Ensure main direction points towards positive value
-        if V[0,0] < 0. : V = -V
-
-        # Angle of principal axis relative to horizontal
-        inflection_angle = math.atan2(V[0,1], V[0,0])
+        # inflection_angle: angle of principal axis relative to horizontal
+        V, S, inflection_angle = pca(inflection_points)
         # Ratio of singular values
         svalue_ratio = S[1]/S[0]
 
@@ -482,35 +527,41 @@ class RecognitionEngine(object):
         - the number of intersections between scratch and polyline must
         greater than 2 and the number of scratch inflection points minus 1.
 
+        Only objects whose bounding box overlaps the scratch one are
+        tested (see spatial.GridIndex), all at once (see
+        intersection.MultiLineIntersection), against object polylines
+        packed once (see scene_targets()).
         """
         todelete = []
         
         # If no baseline exists, no other object can exist
         if self._baseline is None: return(todelete)
 
-        for obj in self._rays + self._lenses + [self._baseline]:
-            # Compute curvilinear coordinate of intersection points
-            # between scratch and object polyline.
-            object_descriptors = StrokeDescriptors(obj.polyline)
-            intersections = LineIntersection(descriptors, object_descriptors)
-            coordinates = np.asarray([l[3] for l in intersections.parts1[:-1]])
-#            points = descriptors.resample(lengths=coordinates)
+        candidates = self._scene_index.query(bbox(descriptors._a))
+        if not candidates: return(todelete)
 
-            if len(coordinates) >= len(scratch[1])-1 \
-                   and len(coordinates) > 2:
-                todelete.append(obj)
+        # Intersections between scratch and object polylines.
+        objects, targets = self.scene_targets()
+        subset = sorted(self._target_numbers[obj] for obj in candidates)
+        intersections = MultiLineIntersection(descriptors, targets, subset)
+        for k in subset:
+            count = intersections.counts[k]
+            if count >= len(scratch[1])-1 and count > 2:
+                todelete.append(objects[k])
 
         return (todelete)
 
         
-    def baseline_detector(self, descriptors, span=270):
+    def baseline_detector(self, analysis, span=270):
         """Detect if a stroke can be a base line.
+        analysis: StrokeAnalysis object for the stroke.
         Criteria :
         - horizontal line
         - horizontal coordinate of leftmost point is less than -span
         - horizontal coordinate of rightmost point is greater than span.
         """
-        line  = descriptors.straight_line_detector()        
+        descriptors = analysis.descriptors
+        line  = analysis.straight_line
         logging.debug(str(descriptors._a[0,0]))
         logging.debug(str(descriptors._a[-1,0]))
 
@@ -523,8 +574,9 @@ class RecognitionEngine(object):
             return False
 
 
-    def lens_detector(self, descriptors):
+    def lens_detector(self, analysis):
         """Detect if a stroke can be a lens
+        analysis: StrokeAnalysis object for the stroke.
         Criteria :
         - a base line must exist
         - vertical line
@@ -533,7 +585,8 @@ class RecognitionEngine(object):
         """
         if self._baseline is None: return False
         
-        line  = descriptors.straight_line_detector()        
+        descriptors = analysis.descriptors
+        line  = analysis.straight_line
         threshold = 40
         ylocation = self._baseline.ylocation
         ds = descriptors._a[0,1] - ylocation
@@ -558,7 +611,7 @@ class RecognitionEngine(object):
         backend = self._find_lens_backend(lens)
         backend.focal = focal
         backend.update()
-        for ray in self._rays: ray.update()
+        self.update_rays(backend)
 
         
     def set_lens_span(self, lens, span):
@@ -566,7 +619,8 @@ class RecognitionEngine(object):
         backend = self._find_lens_backend(lens)
         backend.span = span
         backend.update(with_span = True)
-        for ray in self._rays: ray.update()
+        self._index_object(backend)
+        # Lenses have no aperture: rays do not change.
 
         
     def set_lens_pos(self, lens, x, y):
@@ -575,11 +629,15 @@ class RecognitionEngine(object):
         x,y : new lens location (lens center)."""
 
         # Find backend object
-        # FIXME: very unefficient. use a dict instead.
         backend = self._find_lens_backend(lens)
+        row = backend.row
         backend.xlocation = x
+        if backend.row != row:
+            # Lens order changed: new ray tracer
+            self._tracer = None
         backend.update()
-        for ray in self._rays: ray.update()
+        self._index_object(backend)
+        self.update_rays(backend)
 
     def set_ray_point(self, ray, x, y):
         """Change the location of a ray base point.
@@ -588,6 +646,7 @@ class RecognitionEngine(object):
         backend = self._find_ray_backend(ray)
         backend.basepoint = np.asarray((x,y))
         backend.update()
+        self._index_object(backend)
 
     def set_ray_direction(self, ray, dir_vec):
         """Change the ray direction:
@@ -597,24 +656,108 @@ class RecognitionEngine(object):
         backend = self._find_ray_backend(ray)
         backend.unit = self.scale_to(dir_vec)
         backend.update()
+        self._index_object(backend)
+
+
+    def update_rays(self, lens=None):
+        """Recompute rays after a lens change, all at once.
+        lens: changed lens (backend object). Only the rays depending on
+        this lens are traced again, after it (see RayTracer.retrace()), and
+        only the rays whose polyline changed are updated (frontend and
+        scene index). Every ray is recomputed if None."""
+        store = self._store
+        rays = store.rays
+        if lens is None or self._tracer is None or not rays:
+            store.set_polylines(self.trace_rays())
+            updated = xrange(len(rays))
+        else:
+            tracer = self._tracer
+            k = lens.row
+            tracer.set_lens(k, x=lens.xlocation, focal=lens.focal)
+            updated = tracer.retrace(store.polylines(), store.basepoints(),
+                                     store.units(), k)
+            if tracing.raytrace:
+                tracing.event('raytrace', 'retrace', lens=k,
+                              rays=len(updated), lenses=len(tracer))
+        for i in updated:
+            ray = rays[i]
+            ray.update(traced=True)
+            self._index_object(ray)
+
+
+    def scene_targets(self):
+        """Return (objects, targets): scene objects and their polylines
+        packed for intersection searches (intersection.PackedLines). They
+        are packed once, then only the lines of added, deleted or changed
+        objects are updated (see _update_target()). Deleted objects are
+        None in objects, until the lines are packed again."""
+        if self._targets is None:
+            objects = [self._registry.get(id)
+                       for id in sorted(self._registry.ids())]
+            a, offsets = pack_strokes([obj.polyline for obj in objects])
+            self._targets = objects, PackedLines(a, offsets)
+            self._target_numbers = dict((obj, k)
+                                        for k, obj in enumerate(objects))
+            self._stale_targets = 0
+        return self._targets
+
+
+    def _update_target(self, obj):
+        """Update the packed line of an object (if lines are packed): in
+        place if its number of points is the same, else it is added again
+        as a new line."""
+        if self._targets is None: return
+        objects, targets = self._targets
+        polyline = obj.polyline
+        k = self._target_numbers.get(obj)
+        if k is not None and targets.offsets[k+1] - targets.offsets[k] \
+                == len(polyline):
+            targets.set_line(k, polyline)
+            return
+        if k is not None: self._drop_target(obj)
+        if self._targets is None: return
+        objects.append(obj)
+        self._target_numbers[obj] = targets.append(polyline)
+
+
+    def _drop_target(self, obj):
+        """Forget the packed line of an object. Lines are packed again
+        when there are more deleted lines than lines in use."""
+        if self._targets is None: return
+        objects, targets = self._targets
+        objects[self._target_numbers.pop(obj)] = None
+        self._stale_targets += 1
+        if self._stale_targets > len(self._target_numbers):
+            self._targets = None
+
+
+    def _index_object(self, obj):
+        """Store (or update) the bounding box of an object in the scene
+        index, and its packed line. Must be called after every polyline
+        change."""
+        self._scene_index.insert(obj, bbox(obj.polyline))
+        self._update_target(obj)
+
+
+    def _add_object(self, obj):
+        """Register a new scene object (see scene.Registry), and store its
+        bounding box in the scene index."""
+        self._registry.add(obj)
+        self._index_object(obj)
+
+
+    def _forget_object(self, obj):
+        """Unregister a deleted scene object, and remove it from the scene
+        index."""
+        self._registry.remove(obj)
+        self._scene_index.remove(obj)
+        self._drop_target(obj)
 
 
     def _find_ray_backend(self, ray_frontend):
         """Find a ray backend object given its frontend"""
-        backend=None
-        for l in self._rays:
-            if l._frontend_object == ray_frontend:
-                backend = l
-                break
-        if backend is None: raise ValueError("No backend object found.")
-        return backend
+        return self._registry.find(ray_frontend, Ray)
 
     def _find_lens_backend(self, ray_frontend):
         """Find a lens backend object given its frontend"""
-        backend=None
-        for l in self._lenses:
-            if l._frontend_object == ray_frontend:
-                backend = l
-                break
-        if backend is None: raise ValueError("No backend object found.")
-        return backend
+        return self._registry.find(ray_frontend, Lens)
@@ -186,7 +186,9 @@ class CanvasScene(QtGui.QGraphicsScene):
     logging.debug("Mouse release (scene).")
     if self.currentitem:
       self.removeItem(self.currentitem)
-      self.engine.push_stroke(self.currentitem.tonumpy())
+      self.currentitem.finish()
+      self.engine.push_stroke(self.currentitem.tonumpy(),
+                              self.currentitem.descriptors.descriptors())
       self.currentitem = None
     else:
       super(CanvasScene, self).mouseReleaseEvent(event)
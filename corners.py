@@ -0,0 +1,219 @@
+# This file is part of Optosketch. It is released under the GPL v2 licence.
+
+"""Corner finding, with the ShortStraw algorithm.
+The line is first resampled with a constant step. For each point, the
+"straw" is the distance between the points w steps before and w steps
+after. Straws are short at corners.
+
+Three passes are made :
+- bottom-up: in each run of straws shorter than a threshold (median
+  straw * 0.95), the shortest straw is a corner.
+- top-down: if the line between two consecutive corners is not straight
+  (see is_line()), a corner is added between them, until every part is
+  straight.
+- collinear merge: corners whose neighbours are joined by a straight
+  line are removed.
+
+Corners are returned as indices in the resampled line, and as
+curvilinear coordinates along the original line. Line ends are always
+corners.
+
+Reference:
+A. Wolin, B. Eoff, T. Hammond, "ShortStraw: a simple and effective corner
+finder for polylines", Eurographics workshop on sketch-based interfaces
+and modeling, 2008. See also Wolin thesis p.67
+"""
+
+import numpy as np
+
+import resample
+
+
+def straws(points, w=3, offsets=None):
+    """Compute straw lengths, one per point.
+    points: resampled line (Nx2 numpy array), or packed lines (with
+    offsets, see descriptors.pack_strokes()).
+    Windows are truncated at line ends."""
+    n = len(points)
+    if offsets is None:
+        offsets = np.asarray((0, n))
+    counts = np.diff(offsets)
+    i = np.arange(n)
+    first = np.repeat(offsets[:-1], counts)
+    last = np.repeat(offsets[1:]-1, counts)
+    d = points[np.minimum(i+w, last)] - points[np.maximum(i-w, first)]
+    return np.sqrt((d**2).sum(1))
+
+
+def _group_median(values, group, ngroups):
+    """Median of values, for each group number (0 <= group < ngroups).
+    Returns NaN for empty groups."""
+    order = np.lexsort((values, group))
+    values = values[order]
+    counts = np.bincount(group, minlength=ngroups)
+    starts = np.r_[0, counts.cumsum()[:-1]]
+    med = np.empty(ngroups)
+    med.fill(np.nan)
+    ok = counts > 0
+    lo = starts[ok] + (counts[ok]-1)//2
+    hi = starts[ok] + counts[ok]//2
+    med[ok] = (values[lo] + values[hi]) / 2
+    return med
+
+
+def bottom_up(straw, w=3, offsets=None):
+    """Bottom-up pass: return indices of shortest straws in each run of
+    straws below threshold. Only points at least w steps away from line
+    ends are considered. Indices are relative to the whole (packed) array.
+    """
+    n = len(straw)
+    if offsets is None:
+        offsets = np.asarray((0, n))
+    counts = np.diff(offsets)
+    k = np.repeat(np.arange(len(counts)), counts)
+    rank = np.arange(n) - np.repeat(offsets[:-1], counts)
+    inner = (rank >= w) & (rank < np.repeat(counts, counts) - w)
+
+    threshold = _group_median(straw[inner], k[inner], len(counts)) * 0.95
+    below = inner & (straw < threshold[k])
+
+    # Runs of consecutive points below threshold: [starts, ends)
+    # Runs never cross line ends, since line ends are not inner points.
+    d = np.diff(np.r_[0, below.astype(np.int8), 0])
+    starts = np.where(d == 1)[0]
+    ends = np.where(d == -1)[0]
+    if len(starts) == 0:
+        return starts
+    mins = np.minimum.reduceat(straw, np.c_[starts, ends].ravel())[::2]
+
+    # First minimum in each run
+    run = np.cumsum(d[:-1] == 1) - 1
+    candidates = np.where(below & (straw == mins[np.maximum(run, 0)]))[0]
+    _, first = np.unique(run[candidates], return_index=True)
+    return candidates[first]
+
+
+def is_line(points, pathlen, a, b, threshold=0.95):
+    """Tell whether the line between indices a and b is straight: ratio
+    between chord and path length greater than threshold.
+    pathlen: cumulated path length, one value per point."""
+    path = pathlen[b] - pathlen[a]
+    if path == 0.: return True
+    chord = np.sqrt(((points[b] - points[a])**2).sum())
+    return chord / path > threshold
+
+
+def _halfway_corner(straw, a, b):
+    """Index of the shortest straw in the middle half of [a, b]"""
+    quarter = (b - a) // 4
+    lo, hi = a + quarter, b - quarter
+    if hi <= lo: return a
+    return lo + int(straw[lo:hi].argmin())
+
+
+def top_down(points, straw, corners, threshold=0.95):
+    """Top-down passes: add missing corners, then remove corners between
+    collinear neighbours. Indices are relative to points.
+    Returns corner indices, as a list."""
+    corners = list(corners)
+    steps = np.sqrt(((points[1:] - points[:-1])**2).sum(1))
+    pathlen = np.r_[0., steps.cumsum()]
+
+    # Add corners where the line between two corners is not straight.
+    i = 1
+    while i < len(corners):
+        a, b = corners[i-1], corners[i]
+        if not is_line(points, pathlen, a, b, threshold):
+            c = _halfway_corner(straw, a, b)
+            if a < c < b:
+                corners.insert(i, c)
+                continue
+        i += 1
+
+    # Remove corners lying on a straight line
+    i = 1
+    while i < len(corners) - 1:
+        if is_line(points, pathlen, corners[i-1], corners[i+1], threshold):
+            del corners[i]
+        else:
+            i += 1
+
+    return corners
+
+
+def default_step(bbox):
+    """Resampling step: diagonal of the bounding box divided by 40.
+    bbox: xmin, ymin, xmax, ymax (one row per line for a batch)"""
+    bbox = np.asarray(bbox, dtype=float)
+    diag = np.hypot(bbox[..., 2] - bbox[..., 0], bbox[..., 3] - bbox[..., 1])
+    return diag / 40.
+
+
+def shortstraw(a, cumlength, step=None, w=3, threshold=0.95):
+    """ShortStraw corner finder, for one line.
+    a: line (Nx2 numpy array)
+    cumlength: cumulated lengths of a (see StrokeDescriptors._cumlength)
+    step: resampling step. Default: see default_step()
+    w: straw half-window, in steps.
+    threshold: straightness threshold for the top-down passes.
+    Returns (indices, lengths, points): corner indices in the resampled
+    line, corner curvilinear coordinates along a, and resampled line.
+    """
+    length = cumlength[-1]
+    if step is None:
+        step = default_step(np.r_[a.min(0), a.max(0)])
+    if length == 0. or step == 0.:
+        lengths = np.zeros(1)
+    else:
+        lengths = np.r_[resample.uniform_lengths(length, step), length]
+    points = resample.at_lengths(a, cumlength, lengths)
+
+    straw = straws(points, w)
+    corners = np.r_[0, bottom_up(straw, w), len(points)-1]
+    corners = np.unique(corners)
+    corners = np.asarray(top_down(points, straw, corners, threshold))
+    return corners, lengths[corners], points
+
+
+def shortstraw_batch(a, offsets, cumlength, bbox, w=3, threshold=0.95):
+    """ShortStraw corner finder, for packed lines (see
+    StrokeBatchDescriptors for the meaning of arguments).
+    Returns (indices, lengths, corner_offsets): packed corner indices
+    (relative to the resampled line) and curvilinear coordinates."""
+    offsets = np.asarray(offsets)
+    seg_offsets = offsets - np.arange(len(offsets))
+    totals = cumlength[seg_offsets[1:]-1]
+    steps = default_step(bbox)
+    steps[steps == 0.] = 1.
+
+    # Resample, with line ends included
+    lengths, loff = resample.batch_uniform_lengths(totals, steps)
+    counts = np.diff(loff) + 1
+    res_offsets = np.r_[0, counts.cumsum()]
+    all_lengths = np.empty(res_offsets[-1])
+    last = res_offsets[1:] - 1
+    inner = np.ones(len(all_lengths), dtype=bool)
+    inner[last] = False
+    all_lengths[inner] = lengths
+    all_lengths[last] = totals
+    points = resample.batch_at_lengths(a, offsets, cumlength,
+                                       all_lengths, res_offsets)
+
+    straw = straws(points, w, res_offsets)
+    candidates = bottom_up(straw, w, res_offsets)
+    split = candidates.searchsorted(res_offsets)
+
+    indices = []
+    corner_lengths = []
+    corner_offsets = [0]
+    for k in range(len(counts)):
+        o, p = res_offsets[k], res_offsets[k+1]
+        corners = np.r_[0, candidates[split[k]:split[k+1]] - o, p-o-1]
+        corners = top_down(points[o:p], straw[o:p], np.unique(corners),
+                           threshold)
+        indices.extend(corners)
+        corner_lengths.extend(all_lengths[o:p][corners])
+        corner_offsets.append(len(indices))
+
+    return (np.asarray(indices, dtype=int), np.asarray(corner_lengths),
+            np.asarray(corner_offsets))
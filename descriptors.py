@@ -3,7 +3,8 @@
 # This file is part of Optosketch. It is released under the GPL v2 licence.
 """Functions and objects to compute various line descriptors.
 StrokeDescriptor is an object that takes a numpy array as input.
-It computes several useful descriptors, including :
+It computes several useful descriptors (all at once, or on first access
+with lazy=True), including :
 - line length (_length)
 - barycenter, weighted (_gcenter) and unweighted (_center)
 - standard deviation (_astd)
@@ -18,7 +19,8 @@ It computes several useful descriptors, including :
  For a complete circle, 2*pi, for an infinity sign or an 8 it is zero.
 
 Useful methods :
-- Extract a sub-part, given lengths since the beginning (extract())
+- Extract a sub-part, given lengths since the beginning (extract()), or
+  many at once (extract_many())
 - Bounding box for a sub-part (bbox_indices())
 - ad-hoc point detector : point_detector(). 
 """
@@ -30,19 +32,94 @@ from array import array
 
 import numpy as np
 from numpy import dot, sin, cos, sqrt, cross
-from numpy.linalg import svd, solve, det
-
-from simplify import simplify_dp
+from numpy.linalg import solve, det
+
+from simplify import simplify, default_thresholds
+from pca import pca, pca_batch, principal_axes, centered_moments
+import resample
+import corners
+import tracing
+
+
+class lazy_attribute(object):
+    """Attribute computed on first access, then stored in the instance.
+    name: attribute name
+    method: name of the method computing the attribute. This method must
+    set the attribute (and may set others at the same time).
+    """
+    def __init__(self, name, method):
+        self.name = name
+        self.method = method
+
+    def __get__(self, obj, objtype=None):
+        if obj is None: return self
+        if tracing.descriptors:
+            tracing.event('descriptors', 'compute', method=self.method,
+                          points=len(obj._a))
+        getattr(obj, self.method)()
+        try:
+            return obj.__dict__[self.name]
+        except KeyError:
+            raise AttributeError(self.name)
 
 
 class StrokeDescriptors(object):
-    """Estimator of various geometric properties. """
-    def __init__(self, a):
+    """Estimator of various geometric properties.
+    With lazy=True, nothing is computed by __init__(): every descriptor is
+    computed on first access, and then cached. Attribute names are the
+    same in both modes."""
+
+    # Descriptors computed on first access (lazy mode)
+    _vectors = lazy_attribute('_vectors', 'segments')
+    _dx = lazy_attribute('_dx', 'segments')
+    _dy = lazy_attribute('_dy', 'segments')
+    _lengths = lazy_attribute('_lengths', 'segments')
+    _cumlength = lazy_attribute('_cumlength', 'segments')
+    _length = lazy_attribute('_length', 'segments')
+    _segcenters = lazy_attribute('_segcenters', 'centers')
+    _center = lazy_attribute('_center', 'centers')
+    _bboxcenter = lazy_attribute('_bboxcenter', 'centers')
+    _gcenter = lazy_attribute('_gcenter', 'gravity_center')
+    _angles = lazy_attribute('_angles', 'angles_quantities')
+    _cumangles = lazy_attribute('_cumangles', 'angles_quantities')
+    _maxrotation = lazy_attribute('_maxrotation', 'angles_quantities')
+    _angle_rate = lazy_attribute('_angle_rate', 'angles_quantities')
+    _cumangles_d = lazy_attribute('_cumangles_d', 'angles_quantities')
+    _anorm = lazy_attribute('_anorm', 'normalize')
+    _astd = lazy_attribute('_astd', 'normalize')
+    _V = lazy_attribute('_V', 'acpn')
+    _S = lazy_attribute('_S', 'acpn')
+    _principal_angle = lazy_attribute('_principal_angle', 'acpn')
+    _span = lazy_attribute('_span', 'span')
+    _anormacp = lazy_attribute('_anormacp', 'normalize_acp')
+    _ar = lazy_attribute('_ar', 'aspect_ratio')
+    _bbox_table = lazy_attribute('_bbox_table', 'bbox_table')
+
+    def __init__(self, a, lazy=False):
         self._a = a
         
         self.atan2 = np.frompyfunc(math.atan2, 2, 1)
+        self._resampled = {} # resample() cache
+        if lazy: return
 
         # Useful quantities 
+        self.segments()
+        self.centers()
+        # Weighted barycenter
+        self.gravity_center()
+
+        if len(self._a) > 2: self.angles_quantities()
+        self.normalize()
+
+        # PCA-related computations
+        self.acpn() # FIXME: rename acp -> pca (french->english)
+        self.span()
+        self.normalize_acp()
+        self.aspect_ratio()
+
+
+    def segments(self):
+        """Compute segment vectors and lengths."""
         # Polyline segments, as vectors.
         self._vectors = self._a[1:, :] - self._a[:-1, :]
         self._dx = self._vectors[:, 0]
@@ -52,25 +129,23 @@ class StrokeDescriptors(object):
         self._lengths = np.sqrt(self._dx**2 + self._dy**2)
         self._cumlength = self._lengths.cumsum()
         self._length = self._cumlength[-1]
-        
+
+
+    def centers(self):
+        """Compute segment centers, unweighted barycenter and bounding box
+        center."""
         # Centers of segments
         self._segcenters = (self._a[1:,:] + self._a[:-1,:])/2
 
         # Unweighted barycenter
         self._center = self._a.mean(0)
-        # Weighted barycenter
-        self.gravity_center()
 
         # Center of bounding box
         self._bboxcenter = (self._a.max(0) + self._a.min(0)) / 2
-        
-        if len(self._a) > 2: self.angles_quantities()
-        self.normalize()
 
-        # PCA-related computations
-        self.acpn() # FIXME: rename acp -> pca (french->english)
-        self.span()
-        self.normalize_acp()
+
+    def aspect_ratio(self):
+        """Ratio of singular values."""
         # Straight lines occur for a.r. app. greater than 10
         self._ar = self._S[0]/self._S[1]
 
@@ -99,7 +174,10 @@ class StrokeDescriptors(object):
 
 
     def angles_quantities(self):
-        """Compute some quantities related to segments relative angles."""
+        """Compute some quantities related to segments relative angles.
+        Nothing is computed for lines with less than three points."""
+        if len(self._a) <= 2: return
+
         # Cosine: scalar product
         c = self._dx[0:-1] * self._dx[1:] + self._dy[0:-1] * self._dy[1:]
         #c /= self._lengths[0:-1]
@@ -118,7 +196,8 @@ class StrokeDescriptors(object):
         # Detrend
         P = np.polyfit(self._cumlength[1:], self._cumangles, 1)
         self._angle_rate = P[0]
-        logging.debug('polynom: '+str(P))
+        if tracing.descriptors:
+            tracing.event('descriptors', 'angle trend', polynom=P)
 
         self._cumangles_d = self._cumangles - np.polyval(P, self._cumlength[1:])
 
@@ -142,8 +221,7 @@ class StrokeDescriptors(object):
     def acpn(self):
         """Make a simple principal component analysis of input data.
         Returns the rotated sample. 
-        X must be a matrix containing one sample per row. The number of
-        columns is arbitrary.
+        X must be a matrix containing one sample per row, and two columns.
 
         Returns V,S,m,U such that :
         X = dot(U, dot(diagflat(S), V)) + m
@@ -157,22 +235,12 @@ class StrokeDescriptors(object):
         (* is the matrix product)
         Rotation around the mean value is given by (X-m) * V.transpose() + m
 
-        det(V) can be +1.0 or -1.0
+        det(V) is always +1.0 (see pca module)
         """
 
-        # Center variables
-        m = dot(np.ones(self._a.shape), np.diagflat(self._center))
-        Xm = self._a - m
-
-        U,S,V = svd(Xm, full_matrices=False);
-
-        # Ensure main direction points towards positive value
-        if V[0,0] < 0. : V = -V
-
-        self._V = V
-        self._S = S
+        self._V, self._S, self._principal_angle = pca(self._a, self._center)
         # Angle of principal axis relative to horizontal
-        self._principal_angle = math.atan2(self._V[0,1], self._V[0,0])
+        self._principal_angle = float(self._principal_angle)
 
 
     def span(self):
@@ -200,15 +268,35 @@ class StrokeDescriptors(object):
         return l*u + self._a[ind]
 
 
+    def bbox_table(self):
+        """Compute a sparse table of bounding boxes: level k, row n is the
+        bounding box (xmin, ymin, xmax, ymax) of points n to n+2**k-1.
+        Levels are (N-2**k+1)x4 arrays."""
+        level = np.hstack((self._a, self._a)).astype(float)
+        table = [level]
+        width = 1
+        while 2*width <= len(level) + width - 1:
+            # Combine two overlapping halves of the previous level
+            n = len(level) - width
+            level = np.hstack((np.minimum(level[:n, :2], level[width:, :2]),
+                               np.maximum(level[:n, 2:], level[width:, 2:])))
+            table.append(level)
+            width *= 2
+        self._bbox_table = table
+
+
     # User methods
     def bbox_indices(self, n1, n2):
-        """Compute bounding box for line between two indices.
+        """Compute bounding box for line between two indices (included), in
+        constant time (see bbox_table()).
         Order : xmin, ymin, xmax, ymax."""
-        bb = np.zeros(4)
         assert (n2+1 <= self._a.shape[0])
-        bb[0:2] = self._a[n1:n2+1,:].min(0)
-        bb[2:4] = self._a[n1:n2+1,:].max(0)    
-        return bb
+        k = int(n2 - n1 + 1).bit_length() - 1
+        level = self._bbox_table[k]
+        b1 = level[n1].tolist()
+        b2 = level[n2 - (1 << k) + 1].tolist()
+        return (min(b1[0], b2[0]), min(b1[1], b2[1]),
+                max(b1[2], b2[2]), max(b1[3], b2[3]))
 
     #def bbox_length(self, l1, l2):
 #    """Compute bounding box for line between two lengths."
@@ -216,37 +304,43 @@ class StrokeDescriptors(object):
     def extract(self, l1, l2):
         """Return the part of the polyline between lengths l1 and l2, starting
         from the beginning of the line."""
-        ind = self._cumlength.searchsorted([l1, l2])
-        
-        # First point: always exists
-        ends = 0
-        if ind[0] == 0:
-            d = l1
-        else:
-            d = l1 - self._cumlength[ind[0]-1]
-        assert (d>=0)
-        first = self.midpoint(d, ind[0])
-        ends += 1
-
-        # Second point
-        if ind[1] == len(self._cumlength):
-            # No extrapolation
-            second = None
-        else:
-            d = l2 - self._cumlength[ind[1]-1]
-            assert (d >= 0)
-            second = self.midpoint(d, ind[1])
-            ends += 1
-
-        n = ind[1]-ind[0]
-        c = np.zeros((n+ends,2))
-        # Add first point
-        c[0,:] = first
-        c[1:1+n,:] = self._a[ind[0]+1:ind[1]+1,:]
-
-        if not second is None: c[-1,:] = second
-
-        return c
+        return self.extract_many(((l1, l2),))[0]
+
+
+    def extract_many(self, intervals):
+        """Extract many parts of the polyline at once (see extract()).
+        intervals: pairs of lengths (l1, l2), with l1 <= l2 (Kx2 array).
+        Returns (points, offsets): part k is points[offsets[k]:offsets[k+1]]
+        (see pack_strokes()). Parts are made of the point at l1, line
+        points strictly between l1 and l2, and the point at l2 (omitted if
+        l2 is beyond the line end)."""
+        intervals = np.asarray(intervals, dtype=float).reshape(-1, 2)
+        cl = self._cumlength
+        ind = cl.searchsorted(intervals.ravel()).reshape(-1, 2)
+        # Distances from the start of segments containing l1 and l2
+        d = intervals - np.where(ind > 0, cl[ind-1], 0.)
+        i1, i2 = ind[:,0], ind[:,1]
+        second = i2 < len(cl) # No extrapolation
+        assert (d[:,0] >= 0).all() and (d[second,1] >= 0).all()
+
+        inner = i2 - i1 # Line points strictly inside the part
+        counts = 1 + inner + second
+        offsets = np.zeros(len(counts)+1, dtype=int)
+        offsets[1:] = counts.cumsum()
+        c = np.empty((offsets[-1], 2))
+
+        # End points (see midpoint())
+        u = self._vectors[i1]/self._lengths[i1][:,np.newaxis]
+        c[offsets[:-1],:] = d[:,0][:,np.newaxis]*u + self._a[i1,:]
+        j = i2[second]
+        u = self._vectors[j]/self._lengths[j][:,np.newaxis]
+        c[offsets[1:][second]-1,:] = d[second,1][:,np.newaxis]*u + self._a[j,:]
+
+        # Inner points, copied in one pass
+        rank = np.arange(inner.sum()) - np.repeat(inner.cumsum() - inner, inner)
+        c[np.repeat(offsets[:-1]+1, inner) + rank,:] = \
+            self._a[np.repeat(i1+1, inner) + rank,:]
+        return c, offsets
 
 
     def point_detector(self):
@@ -269,9 +363,12 @@ class StrokeDescriptors(object):
         return (False, None, None)
 
 
-    def straight_line_detector(self):
+    def straight_line_detector(self, simplified=None, algorithm="dp"):
         """Detects a straight line. Use ratio between length and end-to-end
-        distance, on simplified line."""
+        distance, on simplified line.
+        simplified: simplified line, if already computed (see
+        StrokeAnalysis). Computed here otherwise, with the given
+        simplification algorithm (see simplify.simplify())."""
 
         # Use of the simplified line is required to handle overall line length 
         # instability for very small lines. However, this detector is scale
@@ -281,8 +378,11 @@ class StrokeDescriptors(object):
         # length, or use another ratio (e.g. aspect ratio, computed using
         # pca results).
 
-        d = simplify_dp(self._a[:,0], self._a[:,1])
-        s = self._a[d>1.] # Simplified line
+        if simplified is None:
+            d = simplify(self._a[:,0], self._a[:,1], algorithm)
+            s = self._a[d>default_thresholds[algorithm]] # Simplified line
+        else:
+            s = simplified
 
         # Length of simplified line
         # TODO: express as a single line.
@@ -313,32 +413,42 @@ class StrokeDescriptors(object):
             return (False,)
 
 
-    def resample(self, num=80, lengths=None):
-        """Resample line. Wolin thesis p.64-66"""
-        ## TODO: Pass resamp_cl as a parameter.
+    def resample(self, num=80, lengths=None, step=None, count=None):
+        """Resample line. Wolin thesis p.64-66
+        By default, consecutive points are separated by the largest span
+        divided by num. Other modes: explicit step, fixed number of points
+        (count), or explicit curvilinear coordinates (lengths). See the
+        resample module.
+        Results are cached (except for explicit lengths), and must not be
+        modified."""
+        if lengths is not None:
+            return resample.at_lengths(self._a, self._cumlength, lengths)
 
-        # Compute resampled line cumulated length
-        if not lengths is None:
-            resamp_cl = lengths
+        if count is not None:
+            key = ('count', count)
         else:
-            step = self._span.max()/num
-            resamp_cl = np.arange(0., self._cumlength[-1], step)
-
-        _cumlength = np.hstack(([-1e-4], self._cumlength))
-        ind = _cumlength.searchsorted(resamp_cl)-1
-
-        # Unitary vectors along selected segments
-        _lengths = self._lengths[ind]
-        u = self._vectors[ind]/np.vstack((_lengths, _lengths)).transpose()
-
-        _partial_lengths = (resamp_cl-_cumlength[ind])
-        return (np.vstack((_partial_lengths, _partial_lengths)).transpose() * u
-                + self._a[ind])
-
-
-    def corners1(self, w=3):
-        """Bottom-up corner finding. See Wolin thesis p.67 """
-        resampled = self.resample()
+            if step is None: step = self._span.max()/num
+            key = ('step', step)
+
+        try:
+            return self._resampled[key]
+        except KeyError:
+            if count is not None:
+                resampled = resample.resample(self._a, self._cumlength,
+                                              num=count)
+            else:
+                resampled = resample.resample(self._a, self._cumlength,
+                                              step=step)
+            resampled.flags.writeable = False
+            self._resampled[key] = resampled
+            return resampled
+
+
+    def corners1(self, w=3, resampled=None):
+        """Bottom-up corner finding. See Wolin thesis p.67
+        resampled: output of resample(), if already computed."""
+        if resampled is None:
+            resampled = self.resample()
         segments = resampled[w:] - resampled[:-w]
         straws = np.sqrt(segments[:,0]**2 + segments[:,1]**2)
 
@@ -353,6 +463,15 @@ class StrokeDescriptors(object):
         return np.r_[resampled[:1,:], resampled[ind+w-1,:], resampled[-1:,:]]
 
 
+    def shortstraw(self, step=None, w=3, threshold=0.95):
+        """Corner finding, with the complete ShortStraw algorithm. See the
+        corners module.
+        Returns (indices, lengths, points): corner indices in the resampled
+        line, corner curvilinear coordinates, and resampled line."""
+        return corners.shortstraw(self._a, self._cumlength, step=step, w=w,
+                                  threshold=threshold)
+
+
     def distance_to_point(self, point, sl=slice(None)):
         """Compute distance between line and point.
         Computed is minimum distance between the point and every vertex of stroke.
@@ -394,3 +513,423 @@ class StrokeDescriptors(object):
             closed = True
 
         return closed, k1+ind[1], k2
+
+
+class StrokeAnalysis(object):
+    """Per-stroke analysis context, shared by every detector.
+    Each quantity is computed on first request, then cached: a stroke is
+    simplified, resampled, etc. only once, whatever the number of
+    detectors using the result."""
+
+    def __init__(self, a, threshold=None, descriptors=None, algorithm="dp"):
+        """a: stroke coordinates (Nx2 numpy array)
+        threshold: simplification threshold. Default depends on algorithm
+        (see simplify.default_thresholds)
+        descriptors: StrokeDescriptors object for a, if already available
+        (e.g. from IncrementalStrokeDescriptors.descriptors())
+        algorithm: simplification algorithm (see simplify.simplify())"""
+        self._a = a
+        if threshold is None:
+            threshold = default_thresholds[algorithm]
+        self.threshold = threshold
+        self.algorithm = algorithm
+        self._cache = {}
+        if descriptors is not None:
+            self._cache['descriptors'] = descriptors
+
+
+    def _cached(self, name, compute):
+        """Return cached value for name. Call compute() if missing."""
+        try:
+            return self._cache[name]
+        except KeyError:
+            value = self._cache[name] = compute()
+            return value
+
+
+    @property
+    def descriptors(self):
+        """StrokeDescriptors of the raw stroke."""
+        return self._cached('descriptors',
+                            lambda: StrokeDescriptors(self._a))
+
+    @property
+    def importance(self):
+        """Point importance for simplification, one per point (see
+        simplify.simplify())."""
+        return self._cached('importance',
+                            lambda: simplify(self._a[:,0], self._a[:,1],
+                                             self.algorithm))
+
+    @property
+    def simplified(self):
+        """Simplified line, for the threshold given to __init__()."""
+        return self._cached('simplified',
+                            lambda: self._a[self.importance > self.threshold])
+
+    @property
+    def simplified_descriptors(self):
+        """StrokeDescriptors of the simplified line."""
+        return self._cached('simplified_descriptors',
+                            lambda: StrokeDescriptors(self.simplified,
+                                                      lazy=True))
+
+    @property
+    def straight_line(self):
+        """Return value of StrokeDescriptors.straight_line_detector()"""
+        return self._cached('straight_line',
+                            lambda: self.descriptors.straight_line_detector(
+                                simplified=self.simplified))
+
+    @property
+    def corners(self):
+        """Return value of StrokeDescriptors.shortstraw(), default
+        parameters."""
+        return self._cached('corners', lambda: self.descriptors.shortstraw())
+
+
+def pack_strokes(strokes):
+    """Pack a sequence of strokes (Nx2 numpy arrays) into a single array.
+    Returns (a, offsets): points of stroke k are a[offsets[k]:offsets[k+1]]
+    """
+    counts = [len(s) for s in strokes]
+    offsets = np.zeros(len(counts)+1, dtype=int)
+    offsets[1:] = np.cumsum(counts)
+    if len(strokes) == 0:
+        return np.zeros((0, 2)), offsets
+    return np.vstack(strokes).astype(float), offsets
+
+
+def _reduceat(ufunc, values, offsets, empty=np.nan):
+    """Apply ufunc.reduceat() on packed values. Group k is
+    values[offsets[k]:offsets[k+1]]. Empty groups are set to 'empty'."""
+    counts = np.diff(offsets)
+    out = np.empty((len(counts),) + values.shape[1:])
+    out.fill(empty)
+    nonempty = counts > 0
+    if nonempty.any():
+        out[nonempty] = ufunc.reduceat(values, offsets[:-1][nonempty], axis=0)
+    return out
+
+
+class StrokeBatchDescriptors(object):
+    """Descriptors of many strokes at once.
+    Strokes are packed in a single array (see pack_strokes()). Every
+    descriptor is computed for all strokes with a few vectorized passes.
+
+    Per-stroke descriptors are arrays with one row per stroke: _length,
+    _center, _bbox (xmin, ymin, xmax, ymax), _bboxcenter, _gcenter, _V,
+    _S, _principal_angle, _span, _ar, _maxrotation, _angle_rate. They follow
+    the same conventions as the StrokeDescriptors attributes of same name.
+
+    Per-segment and per-angle descriptors are packed like points:
+    _lengths and _cumlength are split by _seg_offsets, _angles and
+    _cumangles by _angle_offsets.
+    """
+    def __init__(self, a, offsets):
+        """a: points of every stroke (Mx2 numpy array)
+        offsets: points of stroke k are a[offsets[k]:offsets[k+1]]"""
+        self._a = np.asarray(a, dtype=float)
+        self._offsets = np.asarray(offsets, dtype=int)
+        self._counts = np.diff(self._offsets)
+        if (self._counts < 2).any():
+            raise ValueError("Every stroke must have at least two points.")
+
+        self.segments()
+        self.centers()
+        self.acpn()
+        self.span()
+        self.angles_quantities()
+
+
+    def __len__(self):
+        """Return number of strokes."""
+        return len(self._counts)
+
+
+    def segments(self):
+        """Compute segment lengths, cumulated lengths and line lengths."""
+        k = np.arange(len(self._offsets))
+        # Segments joining two different strokes are discarded
+        valid = np.ones(max(len(self._a)-1, 0), dtype=bool)
+        valid[self._offsets[1:-1]-1] = False
+
+        self._seg_offsets = self._offsets - k
+        self._vectors = (self._a[1:, :] - self._a[:-1, :])[valid]
+        self._lengths = np.sqrt((self._vectors**2).sum(1))
+        self._segcenters = ((self._a[1:, :] + self._a[:-1, :])/2)[valid]
+
+        # Cumulated lengths restart from zero on each stroke.
+        cs = np.r_[0., self._lengths.cumsum()]
+        base = cs[self._seg_offsets[:-1]]
+        self._cumlength = cs[1:] - np.repeat(base, self._counts-1)
+        self._length = cs[self._seg_offsets[1:]] - base
+
+
+    def centers(self):
+        """Compute barycenters (unweighted and weighted) and bounding
+        boxes."""
+        o = self._offsets
+        self._center = _reduceat(np.add, self._a, o) \
+                       / self._counts[:, np.newaxis]
+        self._bbox = np.hstack((_reduceat(np.minimum, self._a, o),
+                                _reduceat(np.maximum, self._a, o)))
+        self._bboxcenter = (self._bbox[:, 0:2] + self._bbox[:, 2:4]) / 2
+
+        weighted = self._segcenters * self._lengths[:, np.newaxis]
+        self._gcenter = _reduceat(np.add, weighted, self._seg_offsets) \
+                        / self._length[:, np.newaxis]
+
+
+    def acpn(self):
+        """Principal component analysis of every stroke. See
+        StrokeDescriptors.acpn(). _V has shape (K, 2, 2), _S (K, 2)"""
+        self._V, self._S, self._principal_angle = pca_batch(
+            self._a, self._offsets, self._center)
+        self._ar = self._S[:, 0] / self._S[:, 1]
+
+
+    def span(self):
+        """Compute line spans along principal axis."""
+        V = np.repeat(self._V, self._counts, axis=0)
+        p = (V * self._a[:, np.newaxis, :]).sum(2)
+        self._span = _reduceat(np.maximum, p, self._offsets) \
+                     - _reduceat(np.minimum, p, self._offsets)
+
+
+    def angles_quantities(self):
+        """Compute segments relative angles, cumulated angles, maximum
+        rotation and angle rate. See StrokeDescriptors.angles_quantities().
+        Per-stroke values are NaN for strokes with less than three points
+        (angle rate: less than four points)."""
+        k = np.arange(len(self._offsets))
+        # Pairs of consecutive segments, in the same stroke.
+        valid = np.ones(max(len(self._vectors)-1, 0), dtype=bool)
+        valid[self._seg_offsets[1:-1]-1] = False
+        j = np.where(valid)[0]
+
+        self._angle_offsets = self._offsets - 2*k
+        v0 = self._vectors[j]
+        v1 = self._vectors[j+1]
+        c = v0[:, 0] * v1[:, 0] + v0[:, 1] * v1[:, 1]
+        s = v0[:, 0] * v1[:, 1] - v0[:, 1] * v1[:, 0]
+        self._angles = np.arctan2(s, c)
+
+        o = self._angle_offsets
+        cs = np.r_[0., self._angles.cumsum()]
+        self._cumangles = cs[1:] - np.repeat(cs[o[:-1]], self._counts-2)
+        self._maxrotation = _reduceat(np.maximum, self._cumangles, o) \
+                            - _reduceat(np.minimum, self._cumangles, o)
+
+        # Slope of linear fit of cumulated angles vs. cumulated lengths
+        x = self._cumlength[j+1]
+        y = self._cumangles
+        n = (self._counts-2).astype(float)
+        sx = _reduceat(np.add, x, o)
+        sy = _reduceat(np.add, y, o)
+        sxx = _reduceat(np.add, x*x, o)
+        sxy = _reduceat(np.add, x*y, o)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self._angle_rate = (n*sxy - sx*sy) / (n*sxx - sx*sx)
+
+
+    def resample(self, num=80, step=None, count=None,
+                 lengths=None, length_offsets=None):
+        """Resample every stroke. Modes are the same as for
+        StrokeDescriptors.resample(). lengths and length_offsets are packed
+        curvilinear coordinates.
+        Returns (points, offsets): resampled points, packed."""
+        if lengths is None:
+            if count is not None:
+                lengths, length_offsets = resample.batch_count_lengths(
+                    self._length, count)
+            else:
+                if step is None: step = self._span.max(1)/num
+                lengths, length_offsets = resample.batch_uniform_lengths(
+                    self._length, step)
+        points = resample.batch_at_lengths(self._a, self._offsets,
+                                           self._cumlength,
+                                           lengths, length_offsets)
+        return points, length_offsets
+
+
+    def shortstraw(self, w=3, threshold=0.95):
+        """Corner finding for every stroke (see corners.shortstraw_batch())
+        Returns (indices, lengths, offsets): corner indices in resampled
+        strokes and curvilinear coordinates, packed with offsets."""
+        return corners.shortstraw_batch(self._a, self._offsets,
+                                        self._cumlength, self._bbox,
+                                        w=w, threshold=threshold)
+
+
+    def cumlength(self, k):
+        """Return cumulated lengths of stroke k (view)."""
+        return self._cumlength[self._seg_offsets[k]:self._seg_offsets[k+1]]
+
+    def angles(self, k):
+        """Return segment relative angles of stroke k (view)."""
+        return self._angles[self._angle_offsets[k]:self._angle_offsets[k+1]]
+
+    def stroke(self, k):
+        """Return points of stroke k (view)."""
+        return self._a[self._offsets[k]:self._offsets[k+1]]
+
+
+class IncrementalStrokeDescriptors(object):
+    """Descriptors updated point by point, while a stroke is being drawn.
+    Each call to add_point() costs O(1). Available at any time:
+    - line length (_length) and cumulated lengths (_cumlength)
+    - bounding box (_bbox, order: xmin, ymin, xmax, ymax) and its center
+      (_bboxcenter)
+    - barycenters, weighted (_gcenter) and unweighted (_center)
+    - principal axis, from first and second moments (acpn())
+    - segment angles (_angles), cumulated angle (_cumangle), sum of
+      absolute values of angles (_abs_angle_sum), peak-to-peak amplitude
+      of cumulated angles (_maxrotation), and angle rate (_angle_rate).
+    descriptors() gives the StrokeDescriptors object for the points added
+    so far, without recomputing these quantities.
+    """
+    def __init__(self, point=None):
+        """point: first point (x, y), optional."""
+        self._points = array('d')
+        self._cumlength = array('d')
+        self._angles = array('d')
+        self._length = 0.
+        self._cumangle = 0.
+        self._abs_angle_sum = 0.
+        self._maxrotation = 0.
+        self._bbox = None
+
+        # Moments are computed relative to the first point, to avoid
+        # loss of precision.
+        self._origin = None
+        self._s = np.zeros(5) # x, y, x**2, y**2, x*y
+        self._gs = np.zeros(2) # sum of segment centers weighted by lengths
+        self._rs = np.zeros(4) # linear regression of cumulated angles: x, y, x**2, x*y
+        self._cumangle_min = self._cumangle_max = None
+        self._last = None # last segment, as a vector
+
+        if point is not None: self.add_point(*point)
+
+
+    def __len__(self):
+        """Return number of points."""
+        return len(self._points) // 2
+
+
+    def add_point(self, x, y):
+        """Append a point to the stroke."""
+        x = float(x)
+        y = float(y)
+        if self._origin is None:
+            self._origin = (x, y)
+            self._bbox = [x, y, x, y]
+        else:
+            px, py = self._points[-2], self._points[-1]
+            dx, dy = x - px, y - py
+            length = math.sqrt(dx*dx + dy*dy)
+            self._length += length
+            self._cumlength.append(self._length)
+
+            ox, oy = self._origin
+            self._gs[0] += length * ((x + px)/2 - ox)
+            self._gs[1] += length * ((y + py)/2 - oy)
+
+            if self._last is not None:
+                self._add_angle(dx, dy)
+            self._last = (dx, dy)
+
+            bb = self._bbox
+            if x < bb[0]: bb[0] = x
+            if y < bb[1]: bb[1] = y
+            if x > bb[2]: bb[2] = x
+            if y > bb[3]: bb[3] = y
+
+        self._points.append(x)
+        self._points.append(y)
+
+        ux, uy = x - self._origin[0], y - self._origin[1]
+        s = self._s
+        s[0] += ux
+        s[1] += uy
+        s[2] += ux*ux
+        s[3] += uy*uy
+        s[4] += ux*uy
+
+
+    def _add_angle(self, dx, dy):
+        """Update angle-related quantities with a new segment (dx, dy)"""
+        ldx, ldy = self._last
+        angle = math.atan2(ldx*dy - ldy*dx, ldx*dx + ldy*dy)
+        self._angles.append(angle)
+        self._cumangle += angle
+        self._abs_angle_sum += abs(angle)
+
+        if self._cumangle_min is None:
+            self._cumangle_min = self._cumangle_max = self._cumangle
+        else:
+            self._cumangle_min = min(self._cumangle_min, self._cumangle)
+            self._cumangle_max = max(self._cumangle_max, self._cumangle)
+        self._maxrotation = self._cumangle_max - self._cumangle_min
+
+        # Regression of cumulated angles against cumulated lengths
+        rs = self._rs
+        rs[0] += self._length
+        rs[1] += self._cumangle
+        rs[2] += self._length**2
+        rs[3] += self._length * self._cumangle
+
+
+    @property
+    def _a(self):
+        """Points added so far (Nx2 numpy array, shares memory)"""
+        return np.frombuffer(self._points).reshape(-1, 2)
+
+    @property
+    def _center(self):
+        return np.asarray(self._origin) + self._s[0:2]/len(self)
+
+    @property
+    def _gcenter(self):
+        return np.asarray(self._origin) + self._gs/self._length
+
+    @property
+    def _bboxcenter(self):
+        bb = self._bbox
+        return np.asarray(((bb[0]+bb[2])/2, (bb[1]+bb[3])/2))
+
+    @property
+    def _angle_rate(self):
+        """Slope of the linear fit of cumulated angles against cumulated
+        length. See StrokeDescriptors.angles_quantities()"""
+        n = len(self._angles)
+        sx, sy, sxx, sxy = self._rs
+        return (n*sxy - sx*sy) / (n*sxx - sx*sx)
+
+
+    def acpn(self):
+        """Principal component analysis, from moments. Set _V, _S and
+        _principal_angle. See StrokeDescriptors.acpn()"""
+        V, S, angle = principal_axes(*centered_moments(len(self), *self._s))
+        self._V, self._S, self._principal_angle = V, S, float(angle)
+
+
+    def descriptors(self):
+        """Return a (lazy) StrokeDescriptors object for the points added
+        so far. Quantities known here are not computed again."""
+        d = StrokeDescriptors(self._a.copy(), lazy=True)
+        d._cumlength = np.frombuffer(self._cumlength).copy()
+        d._length = self._length
+        d._center = self._center
+        d._bboxcenter = self._bboxcenter
+        d._gcenter = self._gcenter
+
+        self.acpn()
+        d._V, d._S, d._principal_angle = self._V, self._S, self._principal_angle
+
+        if len(self) > 2:
+            d._angles = np.frombuffer(self._angles).copy()
+            d._cumangles = d._angles.cumsum()
+            d._maxrotation = self._maxrotation
+            d._angle_rate = self._angle_rate
+        return d
@@ -5,7 +5,51 @@ This module handle self-intersection (and intersections between two
 different lines in the future).
 """
 import numpy as np
-import logging
+import heapq
+
+import tracing
+from predicates import cross_sign, cross_signs, orientation
+
+
+def _cross(u, v):
+    """z-component of the cross products of two arrays of 2D vectors
+    (one vector per row), computed like numpy.cross()."""
+    return u[:,0]*v[:,1] - u[:,1]*v[:,0]
+
+
+def _same(u, v):
+    """Rowwise equality of two arrays of points"""
+    return abs(u-v).sum(1) == 0
+
+
+# Line parts, between two cuts: crossing numbers at both ends (-1 for line
+# ends), and curvilinear coordinates of both ends (l1 <= l2).
+parts_dtype = np.dtype([('n1', int), ('l1', float), ('n2', int), ('l2', float)])
+
+
+def _cut_parts(numbers, lengths, total):
+    """Cut a line at given curvilinear coordinates.
+    numbers: crossing number for each cut
+    lengths: curvilinear coordinate of each cut
+    total: line length
+    Returns (parts, ranks): array of len(lengths)+1 parts (see parts_dtype),
+    and the rank of each cut along the line. Cuts at the same coordinate
+    are ranked in the given order."""
+    numbers = np.asarray(numbers, dtype=int)
+    lengths = np.asarray(lengths, dtype=float)
+    order = lengths.argsort(kind='mergesort')
+    ranks = np.empty(len(order), dtype=int)
+    ranks[order] = np.arange(len(order))
+
+    parts = np.empty(len(order)+1, dtype=parts_dtype)
+    parts['n1'][0] = -1
+    parts['l1'][0] = 0.
+    parts['n1'][1:] = parts['n2'][:-1] = numbers[order]
+    parts['l1'][1:] = parts['l2'][:-1] = lengths[order]
+    parts['n2'][-1] = -1
+    parts['l2'][-1] = total
+    return parts, ranks
+
 
 class Intersection(object):
     """Base class for line intersection computation. This class contains all
@@ -25,8 +69,7 @@ class Intersection(object):
         if xmax < xmin: return None
         if ymax < ymin: return None
 
-        bb = np.asarray((xmin, ymin, xmax, ymax))
-        return bb
+        return (xmin, ymin, xmax, ymax)
 
 
     def _two_segments_crossing(self, n1, p1, n2, p2, different=False):
@@ -49,75 +92,70 @@ class Intersection(object):
             x4 = self._a[p2,:]
 
         # Handle a lot of pathological cases
-        logging.log(5, "[_two_segments_crossing] Points following")
-        logging.log(5, "[_two_segments_crossing] "  +str(x1) +' '+str(x2))
-        logging.log(5, "[_two_segments_crossing] "  +str(x3) +' '+str(x4))
-
-        logging.log(5, "[_two_segments_crossing] Vectors following")
-        logging.log(5, '[_two_segments_crossing] 1-3: ' +str(x1 - x3))
-        logging.log(5, '[_two_segments_crossing] 3-2: ' +str(x3 - x2))
-        logging.log(5, '[_two_segments_crossing] 2-4: ' +str(x2 - x4))
-        logging.log(5, '[_two_segments_crossing] 4-1: ' +str(x4 - x1))
+        if tracing.intersection:
+            tracing.event('intersection', 'segments', n1=n1, p1=p1, n2=n2,
+                        p2=p2, points=(x1, x2, x3, x4))
 
         # When one segment is of length zero, consider there is no intersection.
         # Side segments will report a crossing point.
         # Should never happen after line simplification
-        if abs(x1-x2).sum() == 0:
-            logging.log(5, "[_two_segments_crossing] Zero-length segment")
-            return None 
-        if abs(x3-x4).sum() == 0:
-            logging.log(5, "[_two_segments_crossing] Zero-length segment")
+        if abs(x1-x2).sum() == 0 or abs(x3-x4).sum() == 0:
+            if tracing.intersection:
+                tracing.event('intersection', 'discard', reason='zero-length')
             return None
 
-        #1-3/3-2/2-4/4-1
-        cp1 = np.cross(x1-x3, x3-x2)
-        cp2 = np.cross(x3-x2, x2-x4)
-        cp3 = np.cross(x2-x4, x4-x1)
-        cp4 = np.cross(x4-x1, x1-x3)
-        logging.log(5, "[_two_segments_crossing] CP: "+str(cp1)+' '+str(cp2)+' '+str(cp3)+' '+str(cp4))
+        #1-3/3-2/2-4/4-1 (signs of cross products, see predicates)
+        cp1 = cross_sign(x3, x1, x2, x3)
+        cp2 = cross_sign(x2, x3, x4, x2)
+        cp3 = cross_sign(x4, x2, x1, x4)
+        cp4 = cross_sign(x1, x4, x3, x1)
 
         # Check if segments are aligned
-        cp = np.cross(x2-x1, x4-x3)
-        if cp == 0:
-            aligned = True
-            logging.log(5, "[_two_segments_crossing] segments aligned (warning)")
-        else: aligned = False
+        aligned = (cross_sign(x1, x2, x3, x4) == 0)
+        if tracing.intersection:
+            tracing.event('intersection', 'cross products',
+                        cp=(cp1, cp2, cp3, cp4), aligned=aligned)
 
         # If two points are at the same location, report only one case.
         if abs(x1-x4).sum() == 0:
-            logging.log(5, "[_two_segments_crossing] 1 == 4 : discard")
+            if tracing.intersection:
+                tracing.event('intersection', 'discard', reason='1 == 4')
             return None
         if abs(x1-x3).sum() == 0:
-            logging.log(5, "[_two_segments_crossing] 1 == 3 : discard")
+            if tracing.intersection:
+                tracing.event('intersection', 'discard', reason='1 == 3')
             return None
         if abs(x2-x4).sum() == 0:
-            logging.log(5, "[_two_segments_crossing] 2 == 4 : discard")
+            if tracing.intersection:
+                tracing.event('intersection', 'discard', reason='2 == 4')
             return None
-        if abs(x2-x3).sum() == 0:
-            logging.log(5, "[_two_segments_crossing] 1 == 3 : ok")
-        else:
+        if abs(x2-x3).sum() != 0:
             # One point may lie on the **direction** of the other segment
             if cp1 == 0 and not aligned: # point 3 on segment 1-2
                 # Intersection will be reported by the other segment
-                logging.log(5, "[_two_segments_crossing] 3 on 1-2 : discard")
+                if tracing.intersection:
+                    tracing.event('intersection', 'discard', reason='3 on 1-2')
                 return None
             if cp4 == 0 and not aligned: # point 1 on segment 3-4
                 # Intersection will be reported by the other segment
-                logging.log(5, "[_two_segments_crossing] 1 on 3-4 : discard")
+                if tracing.intersection:
+                    tracing.event('intersection', 'discard', reason='1 on 3-4')
                 return None
 
-            if cp2 == 0: logging.log(5, "[_two_segments_crossing] 2 on 3-4")
-            if cp3 == 0: logging.log(5, "[_two_segments_crossing] 4 on 1-2")
-
-        if cp1*cp2 < 0: return None
-        if cp2*cp3 < 0: return None
-        if cp3*cp4 < 0: return None
-        logging.debug("*** Crossing found ***")
+        if cp1*cp2 < 0 or cp2*cp3 < 0 or cp3*cp4 < 0:
+            if tracing.intersection:
+                tracing.event('intersection', 'discard', reason='no crossing')
+            return None
 
         # Parallel segments: return any point
         # FIXME: the returned lengths to crossing do not correspond to the
         # same point
-        if cp == 0: return x1, 0, 0
+        cp = np.cross(x2-x1, x4-x3)
+        if aligned or cp == 0:
+            if tracing.intersection:
+                tracing.event('intersection', 'crossing', location=x1,
+                            alpha=0, beta=0, aligned=True)
+            return x1, 0, 0
 
         norm1 = np.sqrt(((x2-x1)**2).sum())
         norm2 = np.sqrt(((x4-x3)**2).sum())
@@ -128,67 +166,94 @@ class Intersection(object):
         # alpha must be between 0 and norm1
         # beta must be between 0 and norm2
         # And... alpha*u1 + x1 == beta*u2 + x3
-        logging.log(5, "[_two_segments_crossing] alpha, norm1: " +str(alpha) + ' '+str(norm1))
-        logging.log(5, "[_two_segments_crossing] beta, norm2: " +str(beta) +' '+ str(norm2))
-        logging.log(5, "[_two_segments_crossing] crossing: " +str(alpha*u1 + x1) + ' == ' + str(beta * u2 + x3))
+        if tracing.intersection:
+            tracing.event('intersection', 'crossing', location=alpha*u1 + x1,
+                        alpha=alpha, beta=beta, norm1=norm1, norm2=norm2)
         # Return coordinates of crossing, and lengths from x1 and x3 to the crossing.
         return (alpha*u1 + x1, alpha, beta)
 
 
+    def _segments_crossing_batch(self, n1, n2, different=False):
+        """Vectorized version of _two_segments_crossing(), for many segment
+        pairs at once. Pair k is made of segments n1[k], n1[k]+1 and n2[k],
+        n2[k]+1 (n1, n2: arrays of indices). Pathological cases are handled
+        the same way.
+        Returns (k, locations, alpha, beta) for crossing pairs only: pair
+        numbers, crossing coordinates (one per row), and lengths from x1
+        and x3 to the crossing."""
+        if different: b = self._b
+        else: b = self._a
+        x1 = self._a[n1,:]
+        x2 = self._a[n1+1,:]
+        x3 = b[n2,:]
+        x4 = b[n2+1,:]
+
+        cp1 = cross_signs(x3, x1, x2, x3)
+        cp2 = cross_signs(x2, x3, x4, x2)
+        cp3 = cross_signs(x4, x2, x1, x4)
+        cp4 = cross_signs(x1, x4, x3, x1)
+        aligned = cross_signs(x1, x2, x3, x4) == 0
+
+        # Zero-length segments, and common points
+        discard = _same(x1, x2) | _same(x3, x4)
+        discard |= _same(x1, x4) | _same(x1, x3) | _same(x2, x4)
+        # One point on the direction of the other segment
+        discard |= (~_same(x2, x3) & ~aligned & ((cp1 == 0) | (cp4 == 0)))
+        discard |= (cp1*cp2 < 0) | (cp2*cp3 < 0) | (cp3*cp4 < 0)
+
+        k = np.where(~discard)[0]
+        if tracing.intersection:
+            tracing.event('intersection', 'batch', pairs=len(n1),
+                          crossings=len(k))
+        x1, x2, x3, x4 = x1[k], x2[k], x3[k], x4[k]
+        cp = _cross(x2-x1, x4-x3)
+
+        # Parallel segments: return any point (see _two_segments_crossing)
+        loc = x1.astype(float)
+        alpha = np.zeros(len(k))
+        beta = np.zeros(len(k))
+        m = ~aligned[k] & (cp != 0)
+        if m.any():
+            x1, x2, x3, x4, cp = x1[m], x2[m], x3[m], x4[m], cp[m]
+            norm1 = np.sqrt(((x2-x1)**2).sum(1))
+            norm2 = np.sqrt(((x4-x3)**2).sum(1))
+            u1 = (x2-x1)/norm1[:,np.newaxis]
+            u2 = (x4-x3)/norm2[:,np.newaxis]
+            alpha[m] = - _cross(u2, x3-x1)/(cp/(norm1*norm2))
+            beta[m] = - _cross(u1, x3-x1)/(cp/(norm1*norm2))
+            loc[m] = alpha[m,np.newaxis]*u1 + x1
+        return k, loc, alpha, beta
+
+
 class SelfIntersection(Intersection):
     """Object for computation and handling of line self-intersections."""
-    def __init__(self, descriptors):
+    def __init__(self, descriptors, method="bisection"):
         """Search for line self-intersections.
         The list of intersections founds is in the 'crossings' attribute.
-        descriptors: StrokeDescriptors object"""
+        descriptors: StrokeDescriptors object
+        method: "bisection" (recursive search, with bounding boxes) or
+        "sweep" (sweep line, see __sweep_intersections()). With "sweep",
+        crossings are sorted by curvilinear coordinate. The sweep is
+        slower on usual strokes, and can report different crossings at
+        touching or retraced points."""
         self._a = descriptors._a
         self._gea = descriptors
         
         # Get crossings
         self.crossings = []
-        self.__intersections(0, self._a.shape[0]-1)
+        if method == "sweep":
+            self.__sweep_intersections()
+        elif method == "bisection":
+            self.__intersections(0, self._a.shape[0]-1)
+        else:
+            raise ValueError("Unknown method: "+str(method))
         
-        # Set up a list containing for each line part number, the associated
-        # crossing numbers and the lengths. 
-        self.parts = [[] for k in range(2*len(self.crossings)+1)]
-
-        # Intersection locations in curve length (curvilinear coordinate)
-        interlengths = []
-        for loc, l1, l2 in self.crossings:
-            interlengths.append(l1)            
-            interlengths.append(l2)
-
-        interlengths.sort()
-        assert(len(interlengths) == len(self.crossings)*2)
-
-        self.parts[0].append(None)
-        self.parts[0].append(0.)
-        for k in range(len(self.crossings)):
-            loc, l1, l2 = self.crossings[k]
-            assert(l1 <= l2)
-
-            partnb = interlengths.index(l1)
-            self.parts[partnb].append(k)
-            self.parts[partnb].append(l1)
-            self.parts[partnb+1].append(k)
-            self.parts[partnb+1].append(l1)
-
-            partnb = interlengths.index(l2)
-            self.parts[partnb].append(k)
-            self.parts[partnb].append(l2)
-            self.parts[partnb+1].append(k)
-            self.parts[partnb+1].append(l2)
-
-        self.parts[-1].append(None)
-        self.parts[-1].append(self._gea._length)
-
-        # Reorder line beginning and end
-        # First and last points are properly ordered
-        for k in range(1,len(self.parts)-1):
-            c = self.parts[k]
-            if c[1] > c[3]:
-                c[1], c[3] = c[3], c[1]
-                c[0], c[2] = c[2], c[0]
+        # Parts of line between crossings (see parts_dtype). Both ends of
+        # crossing k (l1 and l2) are cuts 2*k and 2*k+1.
+        numbers = np.arange(2*len(self.crossings)) // 2
+        lengths = [l for loc, l1, l2 in self.crossings for l in (l1, l2)]
+        self.parts, ranks = _cut_parts(numbers, lengths, self._gea._length)
+        self._ranks = ranks.reshape(-1, 2)
                 
 
     def __len__(self):
@@ -202,34 +267,217 @@ class SelfIntersection(Intersection):
         if len(self.crossings) == 0 and key == 0:
             return self._a
 
-        n1, l1, n2, l2 = self.parts[key]
-        return self._gea.extract(l1, l2)
+        part = self.parts[key]
+        return self._gea.extract(part['l1'], part['l2'])
 
 
-    def get_loops(self):
-        """Return pairs of curvilinear coordinates that correspond to
-        loops. No two intervals overlap."""
+    def get_parts(self):
+        """Return every part of the line at once, packed: (points, offsets),
+        part k is points[offsets[k]:offsets[k+1]] (see
+        StrokeDescriptors.extract_many())."""
+        if len(self.crossings) == 0:
+            return self._a, np.asarray((0, len(self._a)))
+        return self._gea.extract_many(self.parts[['l1', 'l2']].tolist())
 
-        # There may be a better algorithm, this one scale as N^2 in the
-        # worst case (N being the number of subparts). N is always 
-        # small, this should not be a problem.
 
-        index = 0
+    def get_loops(self):
+        """Return pairs of curvilinear coordinates that correspond to
+        loops. No two intervals overlap.
+        A loop goes from one end of a crossing to the other one. Parts are
+        scanned in order: a part ending at the second end of a crossing
+        closes a loop, if the part following the first end is not inside
+        a previous loop. Time is linear in the number of parts."""
+
+        parts = self.parts
+        if len(self.crossings) == 0: # the whole line
+            return [(parts['l1'][0], parts['l2'][0])]
+
+        n2 = parts['n2'].tolist()
+        l1 = parts['l1'].tolist()
+        l2 = parts['l2'].tolist()
+        ranks = self._ranks.tolist()
+
+        index = 0 # first part that may start a loop
         loops = []
-        for p, right in enumerate(self.parts):
-            if right[0] == right[2]: # simple loop
-                loops.append((right[1], right[3]))
+        for p in xrange(len(parts)-1):
+            # Part following the other end of crossing n2[p]
+            r1, r2 = ranks[n2[p]]
+            if r2 != p: continue # first end of the crossing
+            start = r1 + 1
+            if start >= index:
+                loops.append((l1[start], l2[p]))
                 index = p+1
-                continue
-            
-            for n, left in enumerate(self.parts[index:p]):
-                if left[0] == right[2] and not right[2] is None: # loop
-                    loops.append((left[1], right[3]))
-                    index = p+1
 
         return(loops)
 
 
+    def __sweep_intersections(self):
+        """Search for self-intersections with a sweep line (Bentley-Ottmann).
+        Events are line points and crossings, sorted by x then y. Segments
+        cut by the sweep line are kept sorted from bottom to top (status).
+        Crossings are searched only between segments becoming neighbours in
+        the status, and between segments sharing a point. Candidate pairs
+        having a common point are checked with _two_segments_crossing(),
+        like in the recursive search.
+        Vertical segments are never put in the status: they are checked
+        against every segment cut by the sweep line along them.
+        There are O(N+K) events (K: number of crossings), each needing
+        O(log N) comparisons. The status is a list: insertions and
+        removals are memory moves.
+
+        Reference: J. L. Bentley, T. A. Ottmann, "Algorithms for reporting
+        and counting geometric intersections", IEEE Transactions on
+        Computers, C-28(9), pp. 643-647, 1979."""
+        a = self._a
+        x = a[:,0].tolist()
+        y = a[:,1].tolist()
+        nseg = len(x) - 1
+
+        # Segment ends, sorted by x then y ("left" and "right" ends)
+        left = {}
+        right = {}
+        vertical = set()
+        events = set()
+        for k in xrange(nseg):
+            p = (x[k], y[k])
+            q = (x[k+1], y[k+1])
+            if p == q: continue # Zero-length: never crossing
+            if q < p: p, q = q, p
+            left[k] = p
+            right[k] = q
+            if p[0] == q[0]: vertical.add(k)
+            events.add(p)
+            events.add(q)
+
+        starts = {} # point -> segments starting there
+        ends = {}   # point -> segments ending there
+        for k in left:
+            starts.setdefault(left[k], []).append(k)
+            ends.setdefault(right[k], []).append(k)
+
+        def side(k, p):
+            """1 if p is above segment k, -1 if below, 0 if aligned."""
+            return orientation(left[k], right[k], p)
+
+        def position(p, strict):
+            """First status index whose segment is above p (or contains p,
+            if not strict)."""
+            lo, hi = 0, len(status)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                s = side(status[mid], p)
+                if s > 0 or (strict and s == 0): lo = mid + 1
+                else: hi = mid
+            return lo
+
+        tested = set()
+        found = []
+        def check(k1, k2):
+            """Check a pair of segments for crossing, only once."""
+            if k1 > k2: k1, k2 = k2, k1
+            if k2 - k1 < 2 or (k1, k2) in tested: return
+            tested.add((k1, k2))
+            # Segments must have a common point. _two_segments_crossing()
+            # alone may report a crossing when an end of one segment is on
+            # the extension of the other.
+            d1, d2 = side(k2, left[k1]), side(k2, right[k1])
+            d3, d4 = side(k1, left[k2]), side(k1, right[k2])
+            if d1*d2 > 0 or d3*d4 > 0: return
+            if d1 == 0 and d2 == 0: # Aligned: must overlap
+                if right[k1] < left[k2] or right[k2] < left[k1]: return
+            loc = self._two_segments_crossing(k1, k1+1, k2, k2+1)
+            if not loc is None:
+                found.append((k1, k2, loc))
+
+        def compare_slopes(k1, k2):
+            """Compare slopes of two non-vertical segments (like cmp())."""
+            return -cross_sign(left[k1], right[k1], left[k2], right[k2])
+
+        heap = [(p, ()) for p in events]
+        heapq.heapify(heap)
+        scheduled = set()
+        def neighbours(i, p):
+            """Check status segments i and i+1, and schedule their swap if
+            they cross after p."""
+            if i < 0 or i+1 >= len(status): return
+            k1, k2 = status[i], status[i+1]
+            check(k1, k2)
+            if (k1, k2) in scheduled: return
+            # Proper crossing only: ends strictly on both sides.
+            if side(k1, left[k2]) * side(k1, right[k2]) >= 0: return
+            if side(k2, left[k1]) * side(k2, right[k1]) >= 0: return
+            (x1, y1), (x2, y2) = left[k1], right[k1]
+            (x3, y3), (x4, y4) = left[k2], right[k2]
+            t = ((x3-x1)*(y4-y3) - (y3-y1)*(x4-x3)) \
+                / ((x2-x1)*(y4-y3) - (y2-y1)*(x4-x3))
+            c = (x1 + t*(x2-x1), y1 + t*(y2-y1))
+            # Several segments may cross at the current point: c may be
+            # rounded before p.
+            scheduled.add((k1, k2))
+            heapq.heappush(heap, (max(c, p), (k1, k2)))
+
+        status = []
+        verticals = [] # Vertical segments containing the current point
+        while heap:
+            p, pair = heapq.heappop(heap)
+
+            if pair: # Crossing: swap segments, if not done at a point event
+                scheduled.discard(pair) # May be scheduled again later
+                try:
+                    i = status.index(pair[0])
+                except ValueError:
+                    continue
+                if i+1 >= len(status) or status[i+1] != pair[1] \
+                       or compare_slopes(pair[0], pair[1]) <= 0:
+                    continue
+                status[i], status[i+1] = status[i+1], status[i]
+                neighbours(i-1, p)
+                neighbours(i+1, p)
+                continue
+
+            # Segments containing p
+            verticals = [k for k in verticals
+                         if right[k][0] == p[0] and right[k] >= p]
+            lo = position(p, False)
+            hi = position(p, True)
+            through = status[lo:hi]
+            new = [k for k in starts.get(p, []) if not k in vertical]
+            newv = [k for k in starts.get(p, []) if k in vertical]
+            touching = set(through + new + newv + verticals + ends.get(p, []))
+            touching = sorted(touching)
+            for n, k1 in enumerate(touching):
+                for k2 in touching[n+1:]:
+                    check(k1, k2)
+
+            # Vertical segments: check every segment cut along them.
+            for k in newv:
+                for k2 in status[lo:position(right[k], True)]:
+                    check(k, k2)
+            verticals.extend(newv)
+
+            # Update status: segments leaving at p are removed, segments
+            # going on after p are sorted by slope.
+            done = set(ends.get(p, []))
+            for k in done:
+                if k in status[:lo] or k in status[hi:]: status.remove(k)
+            lo = position(p, False)
+            hi = position(p, True)
+            after = [k for k in status[lo:hi] if not k in done] + new
+            after.sort(cmp=compare_slopes)
+            status[lo:hi] = after
+            neighbours(lo-1, p)
+            if after:
+                neighbours(lo+len(after)-1, p)
+
+        # Curvilinear coordinates of crossings, sorted.
+        for k1, k2, loc in found:
+            l1 = loc[1] if k1 == 0 else self._gea._cumlength[k1-1] + loc[1]
+            l2 = self._gea._cumlength[k2-1] + loc[2]
+            if l1 <= l2: self.crossings.append((loc[0], l1, l2))
+            else: self.crossings.append((loc[0], l2, l1))
+        self.crossings.sort(key=lambda c: (c[1], c[2]))
+
+
     def __intersections(self, n, p):
         # No possible intersection
         if p - n <= 1:
@@ -320,9 +568,14 @@ class SelfIntersection(Intersection):
 class LineIntersection(Intersection):
     """Object for computation and handling of intersections of two lines."""
 
+    # Parts of lines with at most this number of segment pairs are tested
+    # at once, with _segments_crossing_batch(), instead of being cut further.
+    batch_size = 256
+
     def __init__(self, descriptorsa, descriptorsb):
         """Search for line intersections.
-        The list of intersections founds is in the 'crossings' attribute."""
+        The list of intersections founds is in the 'crossings' attribute,
+        sorted by curvilinear coordinate along the first line."""
         self._gea = descriptorsa
         self._geb = descriptorsb
         self._a = descriptorsa._a
@@ -331,61 +584,19 @@ class LineIntersection(Intersection):
         # Get crossings
         self.crossings = []
         self._cross_intersection(0, self._a.shape[0]-1, 0, self._b.shape[0]-1)
-
-        # Set up two lists (one per line) containing for each part number,
-        # the associated crossing numbers and the curvilinear coordinate. 
-
-        # Intersection coordinates expressed as curve length, sorted.
-        interl1 = []
-        interl2 = []
-        for loc, l1, l2 in self.crossings:
-            interl1.append(l1)
-            interl2.append(l2)
-        interl1.sort()
-        interl2.sort()
-
-        self.parts1 = [[] for k in range(len(self.crossings)+1)]
-        self.parts2 = [[] for k in range(len(self.crossings)+1)]
-
-        self.parts1[0].append(None)
-        self.parts1[0].append(0.)
-        self.parts2[0].append(None)
-        self.parts2[0].append(0.)
-
-        # Fill in lists
-        for k in range(len(self.crossings)):
-            loc, l1, l2 = self.crossings[k]
-
-            partnb = interl1.index(l1)
-            self.parts1[partnb].append(k)
-            self.parts1[partnb].append(l1)
-            self.parts1[partnb+1].append(k)
-            self.parts1[partnb+1].append(l1)
-
-            partnb = interl2.index(l2)
-            self.parts2[partnb].append(k)
-            self.parts2[partnb].append(l2)
-            self.parts2[partnb+1].append(k)
-            self.parts2[partnb+1].append(l2)
-
-        self.parts1[-1].append(None)
-        self.parts1[-1].append(self._gea._length)
-        self.parts2[-1].append(None)
-        self.parts2[-1].append(self._geb._length)
-
-        # Reorder line beginning and end
-        # First and last points are properly ordered
-        logging.log(10, "self.parts1: "+str(self.parts1))
-        for k in range(1,len(self.parts1)-1):
-            c = self.parts1[k]
-            if c[1] > c[3]:
-                c[1], c[3] = c[3], c[1]
-                c[0], c[2] = c[2], c[0]
-
-            c = self.parts2[k]
-            if c[1] > c[3]:
-                c[1], c[3] = c[3], c[1]
-                c[0], c[2] = c[2], c[0]
+        self.crossings.sort(key=lambda c: (c[1], c[2]))
+
+        # Parts of both lines between crossings (see parts_dtype)
+        numbers = np.arange(len(self.crossings))
+        self.parts1, ranks = _cut_parts(numbers,
+                                        [c[1] for c in self.crossings],
+                                        self._gea._length)
+        self.parts2, ranks = _cut_parts(numbers,
+                                        [c[2] for c in self.crossings],
+                                        self._geb._length)
+        if tracing.intersection:
+            tracing.event('intersection', 'parts', parts1=self.parts1,
+                          parts2=self.parts2)
         
 
     def get_part(self, lineno, value):
@@ -404,11 +615,26 @@ class LineIntersection(Intersection):
             raise IndexError("Unexisting line part") 
 
         if lineno == 0:
-            n1, l1, n2, l2 = self.parts1[value]
-            return self._gea.extract(l1, l2)
+            part = self.parts1[value]
+            return self._gea.extract(part['l1'], part['l2'])
         else:
-            n1, l1, n2, l2 = self.parts2[value]
-            return self._geb.extract(l1, l2)
+            part = self.parts2[value]
+            return self._geb.extract(part['l1'], part['l2'])
+
+
+    def get_parts(self, lineno):
+        """Return every part of a line at once, packed: (points, offsets),
+        part k is points[offsets[k]:offsets[k+1]] (see get_part() and
+        StrokeDescriptors.extract_many())."""
+        if lineno == 0:
+            c, ge, parts = self._a, self._gea, self.parts1
+        elif lineno == 1:
+            c, ge, parts = self._b, self._geb, self.parts2
+        else: raise ValueError("Unknown line number.")
+
+        if len(self.crossings) == 0:
+            return c, np.asarray((0, len(c)))
+        return ge.extract_many(parts[['l1', 'l2']].tolist())
 
 
     def _cross_intersection(self, n1, p1, n2, p2):
@@ -421,11 +647,15 @@ class LineIntersection(Intersection):
         # FIXME: merge with the method of same name in SelfIntersection
         
         debug = False
+        # Small enough: test all segment pairs at once
+        if (p1-n1)*(p2-n2) <= self.batch_size:
+            self._cross_batch(n1, p1, n2, p2)
+            return
+
         # Lines cannot be cut more
         if p1-n1 == 1 and p2-n2 == 1:
             loc = self._two_segments_crossing(n1, p1, n2, p2, different=True)
             if not loc is None:
-                logging.log(5, "[_cross_intersection] loc: " +str(loc) +' '+str(n1)+' '+str(n2))
                 ## loc == (crossing location, alpha, beta)
                 if n1 == 0: l1 = loc[1]
                 else: l1 = self._gea._cumlength[n1-1] + loc[1]
@@ -454,6 +684,30 @@ class LineIntersection(Intersection):
                 self._cross_intersection(n1, p1, q, p2)
 
 
+    def _cross_batch(self, n1, p1, n2, p2):
+        """Test every segment pair in the ranges [n1, p1] and [n2, p2] (see
+        _cross_intersection()), and store crossings found."""
+        i, j = np.mgrid[n1:p1, n2:p2]
+        i, j = i.ravel(), j.ravel()
+
+        # Same bounding box pruning as _cross_intersection(), down to
+        # single segments.
+        a1, a2 = self._a[i,:], self._a[i+1,:]
+        b1, b2 = self._b[j,:], self._b[j+1,:]
+        keep = ((np.minimum(a1, a2) <= np.maximum(b1, b2))
+                & (np.minimum(b1, b2) <= np.maximum(a1, a2))).all(1)
+        i, j = i[keep], j[keep]
+
+        k, loc, alpha, beta = self._segments_crossing_batch(i, j,
+                                                            different=True)
+        i, j = i[k], j[k]
+        cl1, cl2 = self._gea._cumlength, self._geb._cumlength
+        l1 = np.where(i > 0, cl1[i-1] + alpha, alpha)
+        l2 = np.where(j > 0, cl2[j-1] + beta, beta)
+        for m in range(len(k)):
+            self.crossings.append((loc[m], l1[m], l2[m]))
+
+
     def _bbox_intersecting(self, n1, p1, n2, p2):
         """Test whether two portions of two different lines intersect"""
 
@@ -462,3 +716,160 @@ class LineIntersection(Intersection):
         bbi = self._bbox_intersection(b1, b2)
 
         return not bbi is None
+
+
+class PackedLines(object):
+    """Target lines of MultiLineIntersection, packed in single arrays with
+    the data which does not depend on the other line, so that it can be
+    kept between intersection searches:
+    - a, offsets: points of line k are a[offsets[k]:offsets[k+1]] (see
+      descriptors.pack_strokes())
+    - segments: index of the first point of each segment (segments joining
+      two lines are excluded), and line: line of each segment
+    - lo, hi: lower and upper corners of segment bounding boxes
+    - cumlength: curvilinear coordinate of every point along its line
+    Lines can be changed in place (set_line()) or added (append()).
+    """
+    def __init__(self, a, offsets):
+        self.a = np.asarray(a, dtype=float).reshape(-1, 2)
+        self.offsets = np.asarray(offsets, dtype=int)
+
+        valid = np.ones(max(len(self.a)-1, 0), dtype=bool)
+        joins = self.offsets[1:-1]
+        valid[joins[(joins > 0) & (joins < len(self.a))] - 1] = False
+        self.segments = np.where(valid)[0]
+        self.line = self.offsets.searchsorted(self.segments, side='right') - 1
+
+        j = self.segments
+        self.lo = np.minimum(self.a[j,:], self.a[j+1,:])
+        self.hi = np.maximum(self.a[j,:], self.a[j+1,:])
+
+        lengths = np.sqrt(((self.a[1:,:] - self.a[:-1,:])**2).sum(1))
+        cumlength = np.r_[0., (lengths*valid).cumsum()]
+        starts = np.repeat(self.offsets[:-1], np.diff(self.offsets))
+        self.cumlength = cumlength - cumlength[starts]
+
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+
+    def _segment_data(self, points):
+        """Bounding box corners of segments, and cumulated lengths, of one
+        line."""
+        lo = np.minimum(points[:-1,:], points[1:,:])
+        hi = np.maximum(points[:-1,:], points[1:,:])
+        lengths = np.sqrt(((points[1:,:] - points[:-1,:])**2).sum(1))
+        cumlength = np.r_[0., lengths.cumsum()][:len(points)]
+        return lo, hi, cumlength
+
+
+    def set_line(self, k, points):
+        """Change the points of line k, keeping their number (Nx2 array).
+        Only the data of this line is computed again."""
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        p1, p2 = self.offsets[k], self.offsets[k+1]
+        if len(points) != p2 - p1:
+            raise ValueError("Wrong number of points: %d instead of %d"
+                             % (len(points), p2 - p1))
+        self.a[p1:p2] = points
+        s1, s2 = self.segments.searchsorted((p1, p2-1))
+        self.lo[s1:s2], self.hi[s1:s2], self.cumlength[p1:p2] = \
+                        self._segment_data(points)
+
+
+    def append(self, points):
+        """Add a line (Nx2 array). Returns its number."""
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        start = len(self.a)
+        lo, hi, cumlength = self._segment_data(points)
+        segments = np.arange(start, start + len(lo))
+        self.a = np.r_[self.a, points]
+        self.offsets = np.r_[self.offsets, start + len(points)]
+        self.segments = np.r_[self.segments, segments]
+        self.line = np.r_[self.line, np.zeros(len(lo), dtype=int) + len(self)-1]
+        self.lo = np.r_[self.lo, lo]
+        self.hi = np.r_[self.hi, hi]
+        self.cumlength = np.r_[self.cumlength, cumlength]
+        return len(self) - 1
+
+
+class MultiLineIntersection(Intersection):
+    """Intersections of one line with many other lines (targets) at once.
+    Targets are packed in a single array (see PackedLines). Segment pairs
+    of all targets are tested together, with the same rules as
+    LineIntersection.
+
+    Results:
+    - crossings: one list per target, of (location, l1, l2) tuples like
+      LineIntersection.crossings (l1 along the line, l2 along the target),
+      sorted by l1.
+    - counts: number of crossings, per target (numpy array).
+    """
+
+    # Maximum number of segment pairs tested at once (memory use)
+    block_size = 65536
+
+    def __init__(self, descriptors, targets, subset=None):
+        """descriptors: StrokeDescriptors of the line
+        targets: PackedLines
+        subset: indices of the targets to test (every target if None).
+        Other targets get no crossing."""
+        self._gea = descriptors
+        self._a = descriptors._a
+        self._b = targets.a
+        self._offsets = targets.offsets
+        ntargets = len(targets)
+
+        # Target segments (index of first point)
+        j, lo, hi = targets.segments, targets.lo, targets.hi
+        if subset is not None:
+            tested = np.zeros(ntargets, dtype=bool)
+            tested[np.asarray(subset, dtype=int)] = True
+            keep = tested[targets.line]
+            j, lo, hi = j[keep], lo[keep], hi[keep]
+
+        # Keep target segments overlapping the line bounding box
+        n = len(self._a)
+        if n > 0:
+            bb = np.r_[self._a.min(0), self._a.max(0)]
+            keep = ((lo[:,0] <= bb[2]) & (bb[0] <= hi[:,0])
+                    & (lo[:,1] <= bb[3]) & (bb[1] <= hi[:,1]))
+            j, lo, hi = j[keep], lo[keep], hi[keep]
+
+        # Test segment pairs by blocks of line segments
+        i = np.arange(max(n-1, 0))
+        qlo = np.minimum(self._a[:-1,:], self._a[1:,:])
+        qhi = np.maximum(self._a[:-1,:], self._a[1:,:])
+        found = []
+        step = max(1, self.block_size // max(len(j), 1))
+        for start in xrange(0, len(i) if len(j) else 0, step):
+            pi = np.repeat(i[start:start+step], len(j))
+            pj = np.tile(np.arange(len(j)), len(pi) // len(j))
+            # Same bounding box pruning as LineIntersection
+            overlap = ((qlo[pi] <= hi[pj]) & (lo[pj] <= qhi[pi])).all(1)
+            pi, pj = pi[overlap], j[pj[overlap]]
+            k, loc, alpha, beta = self._segments_crossing_batch(
+                pi, pj, different=True)
+            found.append((pi[k], pj[k], loc, alpha, beta))
+
+        if found:
+            pi, pj, loc, alpha, beta = [np.concatenate(f) for f in zip(*found)]
+        else:
+            pi = pj = np.zeros(0, dtype=int)
+            loc = np.zeros((0, 2))
+            alpha = beta = np.zeros(0)
+        target = self._offsets.searchsorted(pj, side='right') - 1
+
+        # Curvilinear coordinates, along the line and along targets
+        l1 = np.where(pi > 0, self._gea._cumlength[pi-1] + alpha, alpha)
+        l2 = targets.cumlength[pj] + beta
+
+        order = np.lexsort((l2, l1, target))
+        self.crossings = [[] for t in range(ntargets)]
+        for m in order:
+            self.crossings[target[m]].append((loc[m], l1[m], l2[m]))
+        self.counts = np.bincount(target, minlength=ntargets)
+        if tracing.intersection:
+            tracing.event('intersection', 'multi', targets=ntargets,
+                          segments=len(j), counts=self.counts)
@@ -0,0 +1,90 @@
+# This file is part of Optosketch. It is released under the GPL v2 licence.
+
+"""Principal component analysis of 2D point sets.
+Principal axes and singular values are obtained in closed form from the
+2x2 scatter matrix (second moments of centered points), instead of a
+singular value decomposition of the Nx2 matrix of points.
+
+Conventions are those of numpy.linalg.svd applied to centered points:
+X - m = dot(U, dot(diagflat(S), V))
+- S: singular values, in decreasing order.
+- V[0,:]: unitary vector giving the main direction, with V[0,0] >= 0.
+- V[1,:]: orthogonal direction. det(V) is always +1.
+
+Every function accepts a batch of point sets as well (leading dimensions
+of the arguments).
+"""
+
+import numpy as np
+
+
+def principal_axes(sxx, syy, sxy):
+    """Principal axes of 2D points, given their scatter matrix
+    [[sxx, sxy], [sxy, syy]] (sums of products of centered coordinates).
+    sxx, syy, sxy can be numbers or arrays of same shape.
+    Returns (V, S, angle): V has shape (..., 2, 2), S (..., 2), angle is the
+    angle of the principal axis relative to horizontal, in [-pi/2, pi/2].
+    """
+    sxx = np.asarray(sxx, dtype=float)
+    syy = np.asarray(syy, dtype=float)
+    sxy = np.asarray(sxy, dtype=float)
+
+    # Eigenvalues of the scatter matrix
+    half_trace = (sxx + syy) / 2
+    delta = np.hypot((sxx - syy) / 2, sxy)
+    S = np.empty(sxx.shape + (2,))
+    S[..., 0] = half_trace + delta
+    S[..., 1] = half_trace - delta
+    S = np.sqrt(np.clip(S, 0., None))
+
+    # Main direction. cos(angle) >= 0 ensures V[0,0] >= 0
+    angle = 0.5 * np.arctan2(2 * sxy, sxx - syy)
+    c = np.cos(angle)
+    s = np.sin(angle)
+    V = np.empty(sxx.shape + (2, 2))
+    V[..., 0, 0] = c
+    V[..., 0, 1] = s
+    V[..., 1, 0] = -s
+    V[..., 1, 1] = c
+
+    return V, S, angle
+
+
+def centered_moments(n, sx, sy, sxx, syy, sxy):
+    """Convert raw moments (sums of x, y, x**2, y**2, x*y over n points) to
+    centered second moments (sxx, syy, sxy).
+    Raw moments should be computed relative to a point close to the data
+    (e.g. its first point) to avoid loss of precision."""
+    n = np.asarray(n, dtype=float)
+    return (sxx - sx * sx / n,
+            syy - sy * sy / n,
+            sxy - sx * sy / n)
+
+
+def pca(a, center=None):
+    """Principal component analysis of a set of points.
+    a: Nx2 numpy array, one point per row.
+    center: mean value of a, if already known.
+    Returns (V, S, angle). See principal_axes()"""
+    if center is None:
+        center = a.mean(0)
+    x = a[:, 0] - center[0]
+    y = a[:, 1] - center[1]
+    return principal_axes(np.dot(x, x), np.dot(y, y), np.dot(x, y))
+
+
+def pca_batch(a, offsets, centers=None):
+    """Principal component analysis of packed point sets.
+    a: points (Mx2 numpy array). Set k is a[offsets[k]:offsets[k+1]], and
+    must not be empty.
+    centers: mean value of each set (Kx2), if already known.
+    Returns (V, S, angle), with one row per set. See principal_axes()"""
+    offsets = np.asarray(offsets)
+    counts = np.diff(offsets)
+    starts = offsets[:-1]
+    if centers is None:
+        centers = np.add.reduceat(a, starts, axis=0) / counts[:, np.newaxis]
+    Xm = a - np.repeat(centers, counts, axis=0)
+    return principal_axes(np.add.reduceat(Xm[:, 0]**2, starts),
+                          np.add.reduceat(Xm[:, 1]**2, starts),
+                          np.add.reduceat(Xm[:, 0]*Xm[:, 1], starts))
@@ -0,0 +1,105 @@
+# This file is part of Optosketch. It is released under the GPL v2 licence.
+
+"""Robust geometric predicates.
+cross_sign(p1, p2, p3, p4) is the sign of the cross product
+(p2-p1) x (p4-p3), and orientation(p, q, r) the sign of (q-p) x (r-p):
++1 if r is on the left of p->q, -1 on the right, 0 if aligned.
+
+The cross product is first computed with floats. Its sign is returned
+when the value is larger than a bound on the rounding error (filter), or
+when every coordinate is a small integer (the float computation is then
+exact, which is the usual case for mouse input). Otherwise it is
+computed again exactly, with fractions (floats and integers are exactly
+converted). Results thus do not depend on the
+evaluation order, and vectorized and scalar versions always agree.
+
+Coordinates must be exactly representable as floats (like every stroke
+coordinate). Non-finite coordinates are not handled exactly: the float
+sign is returned (0 for NaN).
+
+Reference: J. R. Shewchuk, "Adaptive precision floating-point arithmetic
+and fast robust geometric predicates", Discrete & Computational Geometry
+18(3), pp. 305-363, 1997 (error bound of orient2d, ccwerrboundA).
+"""
+
+from fractions import Fraction
+
+import numpy as np
+
+_epsilon = np.finfo(float).eps / 2 # Unit roundoff
+# Error bound on the float cross product, relative to the sum of
+# absolute values of both products.
+error_bound = (3. + 16.*_epsilon) * _epsilon
+# Integer coordinates below this value give exact float cross products
+# (differences below 2**26, products below 2**52).
+exact_integer = 2.**25
+
+
+def _exact_sign(p1, p2, p3, p4):
+    """Sign of (p2-p1) x (p4-p3), with exact arithmetic."""
+    x1, y1, x2, y2, x3, y3, x4, y4 = [Fraction(v) for v in
+                                      (p1[0], p1[1], p2[0], p2[1],
+                                       p3[0], p3[1], p4[0], p4[1])]
+    det = (x2-x1)*(y4-y3) - (y2-y1)*(x4-x3)
+    return (det > 0) - (det < 0)
+
+
+def cross_sign(p1, p2, p3, p4):
+    """Sign of the cross product (p2-p1) x (p4-p3): -1, 0 or 1.
+    Points are sequences of two numbers (tuples, numpy arrays...)."""
+    left = (float(p2[0]) - float(p1[0])) * (float(p4[1]) - float(p3[1]))
+    right = (float(p2[1]) - float(p1[1])) * (float(p4[0]) - float(p3[0]))
+    det = left - right
+    bound = error_bound * (abs(left) + abs(right))
+    if det > bound: return 1
+    if -det > bound: return -1
+    if not (abs(left) + abs(right) < float('inf')):
+        return (det > 0) - (det < 0) # NaN gives 0
+    values = [float(v) for p in (p1, p2, p3, p4) for v in p[:2]]
+    if all(v == int(v) and abs(v) < exact_integer for v in values):
+        return (det > 0) - (det < 0)
+    return _exact_sign(_value(p1), _value(p2), _value(p3), _value(p4))
+
+
+def orientation(p, q, r):
+    """Sign of (q-p) x (r-p): position of r relative to the line p->q."""
+    return cross_sign(p, q, p, r)
+
+
+def cross_signs(p1, p2, p3, p4):
+    """Vectorized cross_sign(): p1 to p4 are arrays of points (one point
+    per row). A single point is broadcast against the other arrays.
+    Returns an int array."""
+    p1, p2, p3, p4 = [np.asarray(p) for p in (p1, p2, p3, p4)]
+    f1, f2, f3, f4 = [p.astype(float) for p in (p1, p2, p3, p4)]
+    left = (f2[...,0] - f1[...,0]) * (f4[...,1] - f3[...,1])
+    right = (f2[...,1] - f1[...,1]) * (f4[...,0] - f3[...,0])
+    det = left - right
+    size = abs(left) + abs(right)
+    sign = np.sign(det).astype(int)
+    sign[np.isnan(det)] = 0
+
+    # Uncertain signs: exact computation
+    uncertain = (abs(det) <= error_bound * size) & np.isfinite(size)
+    if uncertain.any():
+        uncertain &= ~(_small_integers(f1) & _small_integers(f2)
+                       & _small_integers(f3) & _small_integers(f4))
+    if uncertain.any():
+        shape = uncertain.shape
+        p1, p2, p3, p4 = [np.broadcast_to(p, shape + (2,))
+                          for p in (p1, p2, p3, p4)]
+        for n in zip(*np.nonzero(uncertain)):
+            sign[n] = _exact_sign(_value(p1[n]), _value(p2[n]),
+                                  _value(p3[n]), _value(p4[n]))
+    return sign
+
+
+def _small_integers(f):
+    """Tell which points (float array) have small integer coordinates."""
+    return ((f == np.floor(f)) & (abs(f) < exact_integer)).all(-1)
+
+
+def _value(p):
+    """Point as a tuple of Python numbers (exact conversion)."""
+    if isinstance(p, np.ndarray): return p.tolist()
+    return p
@@ -0,0 +1,301 @@
+# This file is part of Optosketch. It is released under the GPL v2 licence.
+
+"""Paraxial ray tracing through thin lenses, for many rays at once.
+A ray is described by its state (h, s, 1) in a plane x = constant: h is
+the ray height, s its slope. Optical elements are 3x3 transfer matrices:
+the usual 2x2 ABCD matrices, with a third column for the lens height
+(lenses are centered on their own y coordinate, not on y = 0).
+
+- free propagation over a distance d: h' = h + d*s
+- thin lens (focal f, center at height y): s' = s - (h - y)/f, for light
+  going to the right (s' = s + (h - y)/f when tracing towards the left)
+
+Lenses are infinitely high (no aperture): a ray is refracted whatever the
+height where it crosses the lens. Rays are traced to the right and to the
+left of their base point: every lens is hit once.
+
+Lens tables are arrays with one row per lens: x, focal, y, sorted by x.
+"""
+
+import numpy as np
+
+
+def translation(d):
+    """Transfer matrices for free propagation over distances d (array).
+    Returns an array of shape d.shape + (3, 3)."""
+    d = np.asarray(d, dtype=float)
+    m = np.zeros(d.shape + (3, 3))
+    m[...,0,0] = m[...,1,1] = m[...,2,2] = 1.
+    m[...,0,1] = d
+    return m
+
+
+def thin_lens(focal, y, direction="right"):
+    """Transfer matrices for thin lenses (focal, y: arrays of same shape).
+    direction: light propagation direction, "right" or "left" (inverse
+    matrix: tracing backwards)."""
+    focal = np.asarray(focal, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if direction == "right": sign = -1.
+    elif direction == "left": sign = 1.
+    else: raise ValueError("Unknown direction: "+str(direction))
+    m = np.zeros(focal.shape + (3, 3))
+    m[...,0,0] = m[...,1,1] = m[...,2,2] = 1.
+    m[...,1,0] = sign / focal
+    m[...,1,2] = - sign * y / focal
+    return m
+
+
+def lens_table(x, focal, y):
+    """Build a lens table (sorted by x) from per-lens sequences."""
+    table = np.c_[np.asarray(x, dtype=float), np.asarray(focal, dtype=float),
+                  np.asarray(y, dtype=float)].reshape(-1, 3)
+    return table[table[:,0].argsort(kind='mergesort')]
+
+
+def _changed(new, old):
+    """Tell which rows of two arrays differ (NaN equals NaN)."""
+    same = (new == old) | (np.isnan(new) & np.isnan(old))
+    return ~same.all(axis=tuple(range(1, same.ndim)))
+
+
+def _scale(vx, vy):
+    """Scale vectors to length 1 (see RecognitionEngine.scale_to())."""
+    factor = np.sqrt(1./(vx**2 + vy**2))
+    return np.c_[vx*factor, vy*factor]
+
+
+class _Chain(object):
+    """Cumulated transfer matrices of a lens table, for rays going to the
+    right. Plane i is just before lens i (plane L: just after the last
+    lens). C[j,i] (j <= i) is the transfer matrix from plane j to plane i:
+    M[i-1] ... M[j], with M[k] = T(x[k+1] - x[k]) L[k].
+    A ray entering the table at lens j is traced to every plane with one
+    product."""
+    def __init__(self, lenses):
+        self.lenses = np.array(lenses, dtype=float).reshape(-1, 3)
+        n = len(self.lenses)
+        self.M = np.zeros((n, 3, 3))
+        self.C = np.zeros((n+1, n+1, 3, 3))
+        self.C[np.arange(n+1), np.arange(n+1)] = np.eye(3)
+        self._update_matrices(0, n)
+        self._update_products(0, n-1)
+
+
+    def _update_matrices(self, k1, k2):
+        """Compute M[k] for k1 <= k < k2."""
+        x, focal, y = self.lenses[k1:k2+1].T
+        d = np.zeros(k2-k1)
+        d[:len(x)-1] = np.diff(x)[:k2-k1] # last lens: no translation
+        self.M[k1:k2] = np.einsum('kij,kjl->kil', translation(d),
+                                  thin_lens(focal[:k2-k1], y[:k2-k1]))
+
+
+    def _update_products(self, k1, k2):
+        """Compute the products through M[k1] to M[k2] (changed): C[j,i]
+        for j <= k2 and i > k1."""
+        for i in xrange(k1+1, len(self.C)):
+            j = min(k2, i-1) + 1
+            self.C[:j,i] = np.einsum('ij,kjl->kil', self.M[i-1],
+                                     self.C[:j,i-1])
+
+
+    def set_lens(self, k, row):
+        """Change lens k (x, focal, y), order must be kept. Only products
+        through lenses k-1 and k are computed again."""
+        self.lenses[k] = row
+        k1 = max(k-1, 0)
+        self._update_matrices(k1, k+1)
+        self._update_products(k1, k)
+
+
+    def trace(self, basepoints, slopes, first, start=0):
+        """Trace rays entering the table at lens 'first' (first = number of
+        lenses: no lens).
+        Returns (heights, slopes): heights on lenses start to L-1 (R x
+        (L-start) array, NaN for lenses before 'first'), and slopes after
+        the last lens (input slopes for rays with no lens)."""
+        x = self.lenses[:,0]
+        n = len(x)
+        heights = np.empty((len(first), n-start))
+        heights.fill(np.nan)
+        slopes = slopes.copy()
+        hit = np.where(first < n)[0]
+        if len(hit) == 0: return heights, slopes
+        j = first[hit]
+        b = basepoints[hit]
+        s = slopes[hit]
+        state = np.c_[b[:,1] + (x[j] - b[:,0])*s, s, np.ones(len(hit))]
+
+        # Heights on lenses start to L-1, and slopes after the last lens
+        rows = self.C[j,start:n,0,:] # (rays, planes, 3)
+        h = np.einsum('rpk,rk->rp', rows, state)
+        planes = np.arange(start, n)
+        h[planes < j[:,np.newaxis]] = np.nan
+        heights[hit] = h
+        slopes[hit] = np.einsum('rk,rk->r', self.C[j,n,1,:], state)
+        return heights, slopes
+
+
+class RayTracer(object):
+    """Ray tracing through a lens table (see lens_table()), with cached
+    transfer matrices between every pair of lenses, in both directions.
+    When a lens changes (set_lens()), only the products going through it
+    are computed again, and retrace() only recomputes ray points after
+    this lens."""
+    def __init__(self, lenses, length=200.):
+        """lenses: lens table
+        length: length of the ray parts beyond the outermost lenses."""
+        self.length = length
+        self._set_lenses(lenses)
+
+
+    def _set_lenses(self, lenses):
+        self.lenses = np.array(lenses, dtype=float).reshape(-1, 3)
+        self._right = _Chain(self.lenses)
+        # Going to the left is going to the right in a mirrored table.
+        self._left = _Chain(self._mirror(self.lenses))
+
+
+    def _mirror(self, lenses):
+        """Mirrored lens table (x -> -x)"""
+        mirrored = lenses[::-1].copy()
+        mirrored[:,0] *= -1.
+        return mirrored
+
+
+    def __len__(self):
+        return len(self.lenses)
+
+
+    def set_lens(self, k, x=None, focal=None, y=None):
+        """Change lens k. Returns its new index in the table (the table is
+        rebuilt if the lens order changes)."""
+        row = self.lenses[k].copy()
+        if x is not None: row[0] = x
+        if focal is not None: row[1] = focal
+        if y is not None: row[2] = y
+        n = len(self.lenses)
+        if (k > 0 and row[0] < self.lenses[k-1,0]) or \
+           (k < n-1 and row[0] > self.lenses[k+1,0]):
+            lenses = self.lenses.copy()
+            lenses[k] = row
+            order = lenses[:,0].argsort(kind='mergesort')
+            self._set_lenses(lenses[order])
+            return int(np.where(order == k)[0][0])
+        self.lenses[k] = row
+        self._right.set_lens(k, row)
+        self._left.set_lens(n-1-k, self._mirror(row[np.newaxis])[0])
+        return k
+
+
+    def trace(self, basepoints, units):
+        """Trace rays. basepoints: points through which rays pass (Rx2
+        array), units: unitary vectors along rays at base points (Rx2).
+        Returns polylines, as an array of shape (R, L+2, 2) (L: number of
+        lenses): start point, points on lenses (in table order), end point.
+        Lenses located at or to the right of a base point are traced
+        towards the right, the other ones towards the left."""
+        basepoints = np.asarray(basepoints, dtype=float).reshape(-1, 2)
+        polylines = np.empty((len(basepoints), len(self.lenses)+2, 2))
+        polylines[:,1:-1,0] = self.lenses[:,0]
+        self.retrace(polylines, basepoints, units)
+        return polylines
+
+
+    def entries(self, basepoints):
+        """Index of the first lens at or to the right of each base point
+        (number of lenses if none): rays go through lenses entries to L-1
+        towards the right, and 0 to entries-1 towards the left."""
+        basepoints = np.asarray(basepoints, dtype=float).reshape(-1, 2)
+        return self.lenses[:,0].searchsorted(basepoints[:,0])
+
+
+    def dependents(self, k, entries):
+        """Rays depending on lens k (index in the table), given their
+        entries(). Returns (right, left): indices of rays going through
+        lens k towards the right, and towards the left. Rays entering at
+        k or k+1 are on both lists, since a move of lens k can put their
+        base point on its other side."""
+        right = np.where(entries <= k+1)[0]
+        left = np.where(entries >= k)[0]
+        return right, left
+
+
+    def retrace(self, polylines, basepoints, units, k=None):
+        """Update polylines (see trace()) in place after a change of lens k
+        (index in the table, None: every lens, or a new lens order): only
+        rays depending on lens k are traced (see dependents()), and only
+        after lens k.
+        Returns the indices of rays whose polyline changed."""
+        basepoints = np.asarray(basepoints, dtype=float).reshape(-1, 2)
+        units = np.asarray(units, dtype=float).reshape(-1, 2)
+        n = len(self.lenses)
+        if k is None:
+            changed = np.ones(len(polylines), dtype=bool)
+            polylines[:,1:-1,0] = self.lenses[:,0]
+        else:
+            changed = polylines[:,1+k,0] != self.lenses[k,0]
+            polylines[:,1+k,0] = self.lenses[k,0]
+
+        # Rays always go to the right
+        vectors = np.where(units[:,:1] > 0, units, -units)
+        slopes = vectors[:,1] / vectors[:,0]
+        first = self.entries(basepoints)
+
+        if k is None:
+            right = left = np.arange(len(first))
+            start = 0
+        else:
+            right, left = self.dependents(k, first)
+            start = k
+        # Towards the right
+        heights, s = self._right.trace(basepoints[right], slopes[right],
+                                       first[right], start)
+        h = polylines[right,1+start:1+n,1]
+        heights = np.where(np.isnan(heights), h, heights)
+        changed[right] |= _changed(heights, h)
+        polylines[right,1+start:1+n,1] = heights
+        changed[right] |= self._ends(polylines, right, basepoints, vectors,
+                                     first, s, n, 1.)
+
+        # Towards the left, in the mirrored table
+        mfirst = n - first[left]
+        mbase = basepoints[left] * (-1., 1.)
+        start = 0 if k is None else n-1-k
+        heights, s = self._left.trace(mbase, -slopes[left], mfirst, start)
+        heights = heights[:,::-1]
+        h = polylines[left,1:1+n-start,1]
+        heights = np.where(np.isnan(heights), h, heights)
+        changed[left] |= _changed(heights, h)
+        polylines[left,1:1+n-start,1] = heights
+        changed[left] |= self._ends(polylines, left, basepoints, vectors,
+                                    first, -s, n, -1.)
+
+        return np.where(changed)[0]
+
+
+    def _ends(self, polylines, rays, basepoints, vectors, first, slopes, n,
+              side):
+        """Set end points (side = 1) or start points (side = -1) of rays.
+        Tell which ones changed."""
+        if side > 0:
+            through = first[rays] < n
+            end = polylines[rays,-2,:]
+            column = -1
+        else:
+            through = first[rays] > 0
+            end = polylines[rays,1,:]
+            column = 0
+        v = vectors[rays]
+        v[through] = _scale(1., slopes[through])
+        end[~through] = basepoints[rays][~through]
+        end = end + side*self.length*v
+        changed = _changed(end, polylines[rays,column,:])
+        polylines[rays,column,:] = end
+        return changed
+
+
+def trace(basepoints, units, lenses, length=200.):
+    """Trace rays through a lens table (see RayTracer.trace())."""
+    return RayTracer(lenses, length).trace(basepoints, units)
@@ -0,0 +1,116 @@
+# This file is part of Optosketch. It is released under the GPL v2 licence.
+
+"""Line resampling functions.
+A line is resampled by linear interpolation of its points against
+curvilinear coordinate (cumulated length). Three modes are available :
+- uniform step: points every 'step' along the line (uniform_lengths())
+- fixed point number: 'num' points, evenly spaced (count_lengths())
+- explicit curvilinear coordinates (at_lengths())
+
+Functions with a "batch" prefix handle many lines at once. Lines (and
+curvilinear coordinates) are then packed in a single array, with an
+offsets array: line k is a[offsets[k]:offsets[k+1]] (see
+descriptors.pack_strokes()).
+
+Reference: Wolin thesis p.64-66
+"""
+
+import numpy as np
+
+
+def at_lengths(a, cumlength, lengths):
+    """Return points of line a located at the given curvilinear
+    coordinates.
+    a: line coordinates (Nx2 numpy array)
+    cumlength: cumulated segment lengths (N-1 values, see
+    StrokeDescriptors._cumlength)
+    lengths: curvilinear coordinates. Values outside [0, line length] are
+    clipped to the line ends.
+    """
+    cl = np.r_[0., cumlength]
+    lengths = np.asarray(lengths, dtype=float)
+    return np.column_stack((np.interp(lengths, cl, a[:, 0]),
+                            np.interp(lengths, cl, a[:, 1])))
+
+
+def uniform_lengths(length, step):
+    """Curvilinear coordinates of points separated by step, for a line
+    of given length. The line end is not included."""
+    return np.arange(0., length, step)
+
+
+def count_lengths(length, num):
+    """Curvilinear coordinates of num evenly spaced points, for a line of
+    given length. Both line ends are included."""
+    return np.linspace(0., length, num)
+
+
+def resample(a, cumlength, step=None, num=None, lengths=None):
+    """Resample line a. Exactly one of step, num or lengths must be given.
+    See uniform_lengths(), count_lengths() and at_lengths()."""
+    if sum(p is not None for p in (step, num, lengths)) != 1:
+        raise ValueError("Exactly one of step, num or lengths is expected.")
+
+    length = cumlength[-1]
+    if step is not None:
+        lengths = uniform_lengths(length, step)
+    elif num is not None:
+        lengths = count_lengths(length, num)
+    return at_lengths(a, cumlength, lengths)
+
+
+def batch_uniform_lengths(lengths, step):
+    """Packed curvilinear coordinates for many lines (see
+    uniform_lengths()).
+    lengths: line lengths (one value per line)
+    step: step, either a number or one value per line.
+    Returns (coordinates, offsets)"""
+    lengths = np.asarray(lengths, dtype=float)
+    step = np.resize(np.asarray(step, dtype=float), lengths.shape)
+    counts = np.ceil(lengths / step).astype(int)
+    offsets = np.r_[0, counts.cumsum()]
+    rank = np.arange(offsets[-1]) - np.repeat(offsets[:-1], counts)
+    return rank * np.repeat(step, counts), offsets
+
+
+def batch_count_lengths(lengths, num):
+    """Packed curvilinear coordinates for many lines (see count_lengths()).
+    lengths: line lengths (one value per line)
+    num: number of points per line.
+    Returns (coordinates, offsets)"""
+    lengths = np.asarray(lengths, dtype=float)
+    offsets = np.arange(len(lengths)+1) * num
+    fraction = np.tile(np.linspace(0., 1., num), len(lengths))
+    return fraction * np.repeat(lengths, num), offsets
+
+
+def batch_at_lengths(a, offsets, cumlength, lengths, length_offsets):
+    """Resample many lines at once. See at_lengths().
+    a, offsets: packed lines.
+    cumlength: packed cumulated lengths, restarting from zero on each
+    line (one value less than points per line, see
+    StrokeBatchDescriptors._cumlength)
+    lengths, length_offsets: packed curvilinear coordinates.
+    Returns resampled points, packed with length_offsets.
+    """
+    offsets = np.asarray(offsets)
+    counts = np.diff(offsets)
+    length_counts = np.diff(length_offsets)
+
+    # Lines are laid end to end along a global curvilinear coordinate.
+    # A unit gap separates consecutive lines, so that interpolation never
+    # mixes two lines.
+    seg_offsets = offsets - np.arange(len(offsets))
+    totals = cumlength[seg_offsets[1:]-1]
+    base = np.r_[0., (totals + 1.).cumsum()[:-1]]
+
+    cl = np.empty(len(a))
+    cl[offsets[:-1]] = base
+    inner = np.ones(len(a), dtype=bool)
+    inner[offsets[:-1]] = False
+    cl[inner] = cumlength + np.repeat(base, counts-1)
+
+    lengths = np.clip(lengths, 0., np.repeat(totals, length_counts))
+    x = lengths + np.repeat(base, length_counts)
+    return np.column_stack((np.interp(x, cl, a[:, 0]),
+                            np.interp(x, cl, a[:, 1])))
@@ -0,0 +1,262 @@
+# This file is part of Optosketch. It is released under the GPL v2 licence.
+
+"""Scene store: lens and ray parameters as columns of numpy arrays.
+Lens rows are kept sorted by x location (rows are inserted at their
+place, found by bisection, and moved when a lens is moved), so that
+lens_table() needs no sort. Ray rows are kept in insertion order, with
+the traced ray polylines (one row of L+2 points per ray, L: number of
+lenses, see raytrace.RayTracer.trace()).
+
+Each row belongs to a handle (see backend.Lens and backend.Ray): handles
+keep their row number in their 'row' attribute, which is updated when
+rows are shifted.
+"""
+
+import numpy as np
+
+
+class SceneStore(object):
+    """Columns of lens parameters (lens_x, lens_focal, lens_span, lens_y)
+    and ray parameters (ray_basepoint, ray_unit: Rx2, ray_polyline:
+    R x (L+2) x 2). Arrays are allocated with spare rows: only the first
+    nlenses (or nrays) rows are valid."""
+    lens_columns = ('lens_x', 'lens_focal', 'lens_span', 'lens_y')
+    ray_columns = ('ray_basepoint', 'ray_unit', 'ray_polyline')
+
+    def __init__(self, capacity=16):
+        self.lenses = [] # handles, in row order
+        self.rays = []
+        self.lens_x = np.empty(capacity)
+        self.lens_focal = np.empty(capacity)
+        self.lens_span = np.empty(capacity)
+        self.lens_y = np.empty(capacity)
+        self.ray_basepoint = np.empty((capacity, 2))
+        self.ray_unit = np.empty((capacity, 2))
+        self.ray_polyline = np.empty((capacity, 2, 2))
+
+
+    @property
+    def nlenses(self):
+        return len(self.lenses)
+
+
+    @property
+    def nrays(self):
+        return len(self.rays)
+
+
+    def _reserve(self, columns, size):
+        """Make room for 'size' rows in columns (doubling capacity)."""
+        capacity = len(getattr(self, columns[0]))
+        if size <= capacity: return
+        while capacity < size: capacity *= 2
+        for name in columns:
+            column = getattr(self, name)
+            new = np.empty((capacity,) + column.shape[1:])
+            new[:len(column)] = column
+            setattr(self, name, new)
+
+
+    def _insert_row(self, columns, handles, k, values):
+        """Insert a row at index k, shifting the following ones."""
+        n = len(handles)
+        self._reserve(columns, n+1)
+        for name, value in zip(columns, values):
+            column = getattr(self, name)
+            column[k+1:n+1] = column[k:n].copy()
+            column[k] = value
+
+
+    def _delete_row(self, columns, handles, k):
+        """Delete row k, shifting the following ones."""
+        n = len(handles)
+        for name in columns:
+            column = getattr(self, name)
+            column[k:n-1] = column[k+1:n].copy()
+
+
+    def _renumber(self, handles, k1, k2):
+        """Set the row attribute of handles k1 to k2-1."""
+        for k in xrange(k1, min(k2, len(handles))):
+            handles[k].row = k
+
+
+    def _lens_index(self, x):
+        """Row where a lens located at x must be inserted (after lenses at
+        the same location)."""
+        return int(self.lens_x[:self.nlenses].searchsorted(x, side='right'))
+
+
+    def add_lens(self, handle, x, focal, span, y):
+        """Add a lens row for a handle. Returns its row."""
+        k = self._lens_index(x)
+        self._insert_row(self.lens_columns, self.lenses, k,
+                         (x, focal, span, y))
+        self.lenses.insert(k, handle)
+        self._renumber(self.lenses, k, self.nlenses)
+        return k
+
+
+    def remove_lens(self, handle):
+        """Delete the row of a lens handle."""
+        k = handle.row
+        self._delete_row(self.lens_columns, self.lenses, k)
+        del self.lenses[k]
+        self._renumber(self.lenses, k, self.nlenses)
+        handle.row = None
+
+
+    def set_lens_x(self, handle, x):
+        """Move a lens. Its row changes if lens order changes. Returns the
+        new row."""
+        k = handle.row
+        n = self.nlenses
+        if (k > 0 and x < self.lens_x[k-1]) or \
+           (k < n-1 and x > self.lens_x[k+1]):
+            values = [getattr(self, name)[k]
+                      for name in self.lens_columns]
+            values[0] = x
+            self._delete_row(self.lens_columns, self.lenses, k)
+            del self.lenses[k]
+            k2 = self._lens_index(x)
+            self._insert_row(self.lens_columns, self.lenses, k2, values)
+            self.lenses.insert(k2, handle)
+            self._renumber(self.lenses, min(k, k2), max(k, k2)+1)
+            return k2
+        self.lens_x[k] = x
+        return k
+
+
+    def lens_table(self):
+        """Lens table sorted by x (see raytrace.lens_table())."""
+        n = self.nlenses
+        return np.c_[self.lens_x[:n], self.lens_focal[:n], self.lens_y[:n]]
+
+
+    def add_ray(self, handle, basepoint, unit):
+        """Add a ray row for a handle (after the other rays), with an
+        undefined polyline (NaN). Returns its row."""
+        k = self.nrays
+        self._insert_row(self.ray_columns, self.rays, k,
+                         (basepoint, unit, np.nan))
+        self.rays.append(handle)
+        handle.row = k
+        return k
+
+
+    def remove_ray(self, handle):
+        """Delete the row of a ray handle."""
+        k = handle.row
+        self._delete_row(self.ray_columns, self.rays, k)
+        del self.rays[k]
+        self._renumber(self.rays, k, self.nrays)
+        handle.row = None
+
+
+    def basepoints(self):
+        """Base points of every ray (view, Rx2)."""
+        return self.ray_basepoint[:self.nrays]
+
+
+    def units(self):
+        """Unit vectors of every ray (view, Rx2)."""
+        return self.ray_unit[:self.nrays]
+
+
+    def polylines(self):
+        """Polylines of every ray (view, R x (L+2) x 2)."""
+        return self.ray_polyline[:self.nrays]
+
+
+    def _polyline_width(self, width):
+        """Set the number of points of ray polylines. Polylines of every
+        ray are undefined (NaN) after a change."""
+        if self.ray_polyline.shape[1] != width:
+            self.ray_polyline = np.empty((len(self.ray_polyline), width, 2))
+            self.ray_polyline.fill(np.nan)
+
+
+    def set_polylines(self, polylines):
+        """Set the polylines of every ray (R x (L+2) x 2 array)."""
+        self._polyline_width(polylines.shape[1])
+        self.ray_polyline[:self.nrays] = polylines
+
+
+    def set_polyline(self, handle, polyline):
+        """Set the polyline of one ray. If the number of points changes
+        (new number of lenses), other rays must be traced again."""
+        self._polyline_width(len(polyline))
+        self.ray_polyline[handle.row] = polyline
+
+
+    def clear(self):
+        """Delete every row."""
+        for handle in self.lenses + self.rays: handle.row = None
+        self.lenses = []
+        self.rays = []
+
+
+class Registry(object):
+    """Scene handles by stable integer id, with constant time lookups
+    between ids, handles and frontend objects. Ids are given in creation
+    order and never reused. Handles get their id in their 'id' attribute,
+    and must have a '_frontend_object' (hashable) when added."""
+    def __init__(self):
+        self._next_id = 0
+        self._handles = {} # id -> handle
+        self._ids = {}     # frontend object -> id
+
+
+    def __len__(self):
+        return len(self._handles)
+
+
+    def __contains__(self, handle):
+        return self._handles.get(getattr(handle, 'id', None)) is handle
+
+
+    def add(self, handle):
+        """Register a handle. Returns its id."""
+        handle.id = self._next_id
+        self._next_id += 1
+        self._handles[handle.id] = handle
+        self._ids[handle._frontend_object] = handle.id
+        return handle.id
+
+
+    def remove(self, handle):
+        """Unregister a handle. Raise KeyError if it is not registered."""
+        del self._handles[handle.id]
+        del self._ids[handle._frontend_object]
+
+
+    def get(self, id):
+        """Handle of an id. Raise KeyError if unknown."""
+        return self._handles[id]
+
+
+    def ids(self):
+        """Ids of every registered handle."""
+        return self._handles.keys()
+
+
+    def id_of(self, frontend_object):
+        """Id of the handle of a frontend object. Raise KeyError if
+        unknown."""
+        return self._ids[frontend_object]
+
+
+    def find(self, frontend_object, kind=None):
+        """Handle of a frontend object, optionally checking its class.
+        Raise ValueError if there is none."""
+        handle = self._handles.get(self._ids.get(frontend_object))
+        if handle is None or (kind is not None
+                              and not isinstance(handle, kind)):
+            raise ValueError("No backend object found.")
+        return handle
+
+
+    def clear(self):
+        """Unregister every handle (ids are not reused)."""
+        self._handles.clear()
+        self._ids.clear()
@@ -0,0 +1,121 @@
+# This file is part of Optosketch. It is released under the GPL v2 licence.
+
+"""Spatial index over scene objects.
+Objects are stored with their bounding box in a uniform grid: each grid
+cell holds the objects whose bounding box overlaps it. A query only looks
+at the cells overlapped by the query bounding box, then checks candidate
+bounding boxes exactly.
+
+Objects covering too many cells (or with non-finite coordinates, like
+rays going to infinity) are stored apart, and are candidates for every
+query.
+
+Bounding boxes are in the order : xmin, ymin, xmax, ymax (see
+StrokeDescriptors.bbox_indices()).
+"""
+
+import math
+
+import numpy as np
+
+
+def bbox(points):
+    """Bounding box of a set of points (Nx2 numpy array), as a tuple."""
+    points = np.asarray(points, dtype=float)
+    xmin, ymin = points.min(0)
+    xmax, ymax = points.max(0)
+    return (xmin, ymin, xmax, ymax)
+
+
+def bbox_overlap(bb1, bb2):
+    """Tell whether two bounding boxes overlap (touching boxes do)."""
+    return (bb1[0] <= bb2[2] and bb2[0] <= bb1[2]
+            and bb1[1] <= bb2[3] and bb2[1] <= bb1[3])
+
+
+class GridIndex(object):
+    """Uniform grid of object bounding boxes.
+    cell: size of grid cells (scene units)
+    max_cells: objects overlapping more cells than this are not stored in
+    the grid, but in a separate set.
+    Objects must be hashable. They are compared by identity for user
+    classes.
+    """
+    def __init__(self, cell=50., max_cells=256):
+        self.cell = float(cell)
+        self.max_cells = max_cells
+        self._cells = {}   # (i, j) -> set of objects
+        self._bboxes = {}  # object -> (bbox, cell range or None)
+        self._large = set()
+
+
+    def __len__(self):
+        return len(self._bboxes)
+
+
+    def __contains__(self, obj):
+        return obj in self._bboxes
+
+
+    def _cell_range(self, bb):
+        """Cell indices (i1, j1, i2, j2) covered by a bounding box (bounds
+        included), or None if there are too many of them."""
+        if not all(np.isfinite(bb)): return None
+        i1 = int(math.floor(bb[0] / self.cell))
+        j1 = int(math.floor(bb[1] / self.cell))
+        i2 = int(math.floor(bb[2] / self.cell))
+        j2 = int(math.floor(bb[3] / self.cell))
+        if (i2-i1+1)*(j2-j1+1) > self.max_cells: return None
+        return i1, j1, i2, j2
+
+
+    def insert(self, obj, bb):
+        """Add an object, or update its bounding box if already there."""
+        if obj in self._bboxes: self.remove(obj)
+        cells = self._cell_range(bb)
+        self._bboxes[obj] = (bb, cells)
+        if cells is None:
+            self._large.add(obj)
+            return
+        i1, j1, i2, j2 = cells
+        for i in xrange(i1, i2+1):
+            for j in xrange(j1, j2+1):
+                self._cells.setdefault((i, j), set()).add(obj)
+
+
+    def remove(self, obj):
+        """Remove an object. Raise KeyError if it is not in the index."""
+        bb, cells = self._bboxes.pop(obj)
+        if cells is None:
+            self._large.discard(obj)
+            return
+        i1, j1, i2, j2 = cells
+        for i in xrange(i1, i2+1):
+            for j in xrange(j1, j2+1):
+                content = self._cells[(i, j)]
+                content.discard(obj)
+                if not content: del self._cells[(i, j)]
+
+
+    def clear(self):
+        """Remove every object."""
+        self._cells.clear()
+        self._bboxes.clear()
+        self._large.clear()
+
+
+    def query(self, bb):
+        """Return the set of objects whose bounding box overlaps bb."""
+        candidates = set(self._large)
+        cells = self._cell_range(bb)
+        if cells is None:
+            candidates.update(self._bboxes)
+        else:
+            i1, j1, i2, j2 = cells
+            for i in xrange(i1, i2+1):
+                for j in xrange(j1, j2+1):
+                    content = self._cells.get((i, j))
+                    if content: candidates.update(content)
+
+        return set(obj for obj in candidates
+                   if bbox_overlap(self._bboxes[obj][0], bb))
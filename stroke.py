@@ -4,8 +4,17 @@ from PyQt4 import QtGui, QtCore
 import numpy as np
 import time
 from frontend import GenericLine
+from descriptors import IncrementalStrokeDescriptors
+from simplify import StreamSimplifier
 
 class StrokeItem(QtGui.QGraphicsPathItem, GenericLine):
+    # Simplification tolerance and radial filter radius, in pixels (see
+    # StreamSimplifier). Drawn points can be up to radius + tolerance
+    # (1 pixel) away from the stored polyline, and farther where the
+    # stroke goes back on itself: Douglas-Peucker distances are measured
+    # to lines, not to segments.
+    tolerance = 0.5
+
     def __init__(self, pos=QtCore.QPointF(0.,0.), 
                  color=QtGui.QColor('black'), width = 1, *args, **kwargs):
         """pos is initial position. """
@@ -17,20 +26,53 @@ class StrokeItem(QtGui.QGraphicsPathItem, GenericLine):
         pen.setWidth(width)
         self.setPen(pen)
         self._time = time.time()
+        # Points added by lineTo() are simplified on the fly. Only points
+        # output by the simplifier are stored in self.path.
+        self.simplifier = StreamSimplifier((pos.x(), pos.y()),
+                                           tolerance=self.tolerance)
+        # Descriptors of stored points, updated on the fly.
+        self.descriptors = IncrementalStrokeDescriptors((pos.x(), pos.y()))
 
 
     def lineTo(self, *pos):
         """Add a new point to the line.""" 
-        self.path.lineTo(*pos)
+        if len(pos) == 1:
+            pos = (pos[0].x(), pos[0].y())
+        for x, y in self.simplifier.add_point(*pos):
+            self._append(x, y)
         _time = time.time()
         if _time - self._time > 0.1: # Avoid updating every time
-            self.setPath(self.path)
+            self.setPath(self._drawn_path())
             self._time = _time
 
 
+    def finish(self):
+        """Store points still pending in the simplifier. To be called
+        when the stroke is complete."""
+        for x, y in self.simplifier.flush():
+            self._append(x, y)
+        self.setPath(self.path)
+
+
+    def _append(self, x, y):
+        """Store a simplified point."""
+        self.path.lineTo(x, y)
+        self.descriptors.add_point(x, y)
+
+
+    def _drawn_path(self):
+        """Stored points, followed by points pending in the simplifier."""
+        path = QtGui.QPainterPath(self.path)
+        for x, y in self.simplifier.pending:
+            path.lineTo(x, y)
+        return path
+
+
     def clear(self):
         """Remove every points from the path."""
         self.path = QtGui.QPainterPath()
+        self.simplifier = StreamSimplifier(tolerance=self.tolerance)
+        self.descriptors = IncrementalStrokeDescriptors()
 
 
     def tonumpy(self):
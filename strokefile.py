@@ -3,6 +3,8 @@
 import numpy as np
 import os.path as osp
 
+from descriptors import pack_strokes
+
 try:
     import h5py
 
@@ -131,6 +133,17 @@ try:
                 yield self.read_stroke(n)
 
 
+        def packed_strokes(self):
+            """Read every stroke at once, packed for StrokeBatchDescriptors.
+            Return: 3-tuple with metadata, points and offsets (see
+            descriptors.pack_strokes())
+            """
+            metadata = self.f['metadata'][:]
+            points, offsets = pack_strokes(
+                [self.f['strokes/s_%.6d' % n][:] for n in metadata['strokeid']])
+            return (metadata, points, offsets)
+
+
         def session_iter(self):
             """Iterate over each session."""
             sessionids = list(set(self.f['metadata']['sessionid']))
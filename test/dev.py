@@ -14,9 +14,10 @@ frt = app.window.ui.canvasview.scene().frontend
 bck = app.engine
 baseline = BCK.Baseline(frt, 0)
 bck._baseline = baseline
-lens = BCK.Lens(frt, 100, baseline._frontend_object, focal=50)
-bck._lenses.append(lens)
+bck._add_object(baseline)
+lens = BCK.Lens(frt, bck._store, 100, baseline._frontend_object, focal=50)
+bck._add_object(lens)
 rvals, unit = (N.array([20, 20]), N.array([1, 0]))
 ray = BCK.Ray(frt, bck, rvals, unit)
-bck._rays.append(ray)
+bck._add_object(ray)
 app.exec_()
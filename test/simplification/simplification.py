@@ -0,0 +1,63 @@
+# -*- encoding: utf-8 -*-
+# This file is part of Optosketch. It is released under the GPL v2 licence.
+"""This file is used to compare simplification algorithms (Douglas-Peuker
+and Visvalingam-Whyatt): running time, number of points kept, and results
+of detectors using the simplified line. Strokes in test/all are arrows,
+closed loops and triangles: they are neither straight lines nor
+scratches."""
+
+import os
+import os.path as osp
+import time
+import numpy as np
+
+import sys
+sys.path.append(osp.join(osp.dirname(__file__), '..', '..'))
+from descriptors import StrokeAnalysis
+from backend import RecognitionEngine
+
+
+def raw_importer(basedir):
+    """Import every stroke file contained in a subdirectory of basedir.
+    Return a list of dict with keys "filename", "data" and "category"
+    (name of the first subdirectory)."""
+    strokes = []
+    for (dirpath, _, filenames) in os.walk(basedir):
+        category = osp.relpath(dirpath, basedir).split(os.sep)[0]
+        strokes.extend([{"filename": osp.join(dirpath, f),
+                         "data": np.loadtxt(osp.join(dirpath, f)),
+                         "category": category}
+                        for f in filenames
+                        if f.startswith('stroke_') and f.endswith('.dat')])
+    return strokes
+
+
+if __name__ == "__main__":
+    basedir = osp.join(osp.dirname(__file__), '..', 'all')
+    strokes = raw_importer(basedir)
+    engine = RecognitionEngine()
+
+    for algorithm in ("dp", "vw"):
+        duration = 0.
+        points = 0
+        detections = {}
+        for s in strokes:
+            analysis = StrokeAnalysis(s['data'], algorithm=algorithm)
+            t0 = time.time()
+            simplified = analysis.simplified
+            duration += time.time() - t0
+            points += len(simplified)
+
+            line = analysis.straight_line[0]
+            scratch = engine.scratch_detector(analysis.simplified_descriptors)[0]
+            count = detections.setdefault(s['category'], [0, 0, 0])
+            count[0] += 1
+            count[1] += bool(line)
+            count[2] += bool(scratch)
+
+        print "--- %s: %.1f ms, %d points kept out of %d ---" % \
+              (algorithm, 1000*duration, points,
+               sum([len(s['data']) for s in strokes]))
+        for category, (n, line, scratch) in sorted(detections.items()):
+            print "%-12s %3d strokes, %3d straight lines, %3d scratches" % \
+                  (category, n, line, scratch)
@@ -0,0 +1,66 @@
+# This file is part of Optosketch. It is released under the GPL v2 licence.
+
+"""Tracing of hot code paths.
+Each subsystem has a module-level flag, tested at the trace point:
+
+    if tracing.intersection:
+        tracing.event('intersection', 'discard', reason='zero-length', n1=n1)
+
+When the flag is off (the default), a trace point only costs this test:
+no string is formatted, no argument is evaluated. When it is on, events
+are stored as (subsystem, name, data) tuples in a ring buffer: data is
+the dictionary of keyword arguments, stored as is (numpy arrays are not
+converted to strings). Older events are dropped when the buffer is full.
+
+Subsystems: descriptors, intersection, detectors, raytrace.
+"""
+
+from collections import deque
+
+subsystems = ('descriptors', 'intersection', 'detectors', 'raytrace')
+
+# Flags (one per subsystem)
+descriptors = False
+intersection = False
+detectors = False
+raytrace = False
+
+_buffer = deque(maxlen=10000)
+
+
+def enable(*names):
+    """Turn tracing on for the given subsystems (all if none given)."""
+    for name in names or subsystems:
+        if name not in subsystems:
+            raise ValueError("Unknown subsystem: " + str(name))
+        globals()[name] = True
+
+
+def disable(*names):
+    """Turn tracing off for the given subsystems (all if none given)."""
+    for name in names or subsystems:
+        if name not in subsystems:
+            raise ValueError("Unknown subsystem: " + str(name))
+        globals()[name] = False
+
+
+def event(subsystem, name, **data):
+    """Record an event. Callers must test the subsystem flag first."""
+    _buffer.append((subsystem, name, data))
+
+
+def events(subsystem=None):
+    """Return recorded events (oldest first), for one subsystem or all."""
+    if subsystem is None: return list(_buffer)
+    return [e for e in _buffer if e[0] == subsystem]
+
+
+def clear():
+    """Remove all recorded events."""
+    _buffer.clear()
+
+
+def set_size(size):
+    """Change the ring buffer size. Most recent events are kept."""
+    global _buffer
+    _buffer = deque(_buffer, maxlen=size)